@@ -0,0 +1,157 @@
+"""
+Startup backlog drain for polling mode.
+
+After a restart, pending updates are fetched in bulk with non-blocking
+getUpdates calls and confirmed before the Updater starts. Redundant ones
+are dropped: repeated identical presses of the same button, craving-scale
+taps superseded by a later tap on the same keyboard, and callback queries
+that are certainly too old to be answered. Superseded callback queries are
+still answered, so their buttons stop showing the loading indicator. The
+rest go to the update queue in their original order.
+"""
+import asyncio
+import logging
+import time
+
+from telegram.error import TelegramError
+
+from logging_setup import elapsed_ms
+from metrics import METRICS, Counter
+
+logger = logging.getLogger(__name__)
+
+# Больше Bot API за один getUpdates не отдаёт
+BATCH_SIZE = 100
+
+DRAINED = METRICS.register(Counter(
+    "bot_backlog_updates_total", "Updates fetched by the startup backlog drain, by outcome.",
+    labels=("outcome",)))
+
+
+def _signature(update):
+    """
+    Identifies a button press: callback data on a particular message, or a message text.
+    """
+    query = update.callback_query
+    if query is not None:
+        message = query.message
+        if message is None:
+            return None
+        return ("callback", message.chat.id, message.message_id, query.data)
+    if update.message is not None and update.message.text is not None:
+        return ("text", update.message.text)
+    return None
+
+
+def _supersedes(previous, current, repeatable_texts, superseded_prefixes):
+    if previous is None or current is None or previous[0] != current[0]:
+        return False
+    if current[0] == "text":
+        return previous == current and current[1] in repeatable_texts
+    if previous == current:
+        return True
+    # Новое нажатие на той же клавиатуре заменяет прежнее (например, другая оценка тяги)
+    prefix = current[3].rpartition("_")[0] if current[3] else ""
+    return (
+        previous[1:3] == current[1:3]
+        and prefix in superseded_prefixes
+        and (previous[3] or "").rpartition("_")[0] == prefix
+    )
+
+
+def coalesce(updates, now=None, repeatable_texts=(), superseded_prefixes=(), callback_max_age=30.0):
+    """
+    Filters a backlog of updates. Returns ``(kept, superseded, counts)``
+    where ``superseded`` lists the coalesced updates and ``counts`` maps
+    "coalesced" and "expired" to the number of dropped updates.
+
+    A callback query carries no date, but it was sent before the next
+    message in the backlog, so that message's date bounds its age from below.
+    """
+    now = time.time() if now is None else now
+    sent_before = [None] * len(updates)
+    next_date = None
+    for index in range(len(updates) - 1, -1, -1):
+        sent_before[index] = next_date
+        message = updates[index].message
+        if message is not None:
+            next_date = message.date.timestamp()
+
+    counts = {"coalesced": 0, "expired": 0}
+    kept = []
+    superseded = []
+    last = {}
+    for update, latest in zip(updates, sent_before):
+        if update.callback_query is not None and latest is not None and now - latest > callback_max_age:
+            counts["expired"] += 1
+            continue
+        user = update.effective_user or update.effective_chat
+        signature = _signature(update)
+        if user is not None:
+            previous = last.get(user.id)
+            if previous is not None and _supersedes(previous[1], signature, repeatable_texts, superseded_prefixes):
+                superseded.append(kept[previous[0]])
+                kept[previous[0]] = None
+                counts["coalesced"] += 1
+            last[user.id] = (len(kept), signature)
+        kept.append(update)
+    return [update for update in kept if update is not None], superseded, counts
+
+
+async def _answer(bot, query):
+    try:
+        await bot.answer_callback_query(query.id)
+    except TelegramError as exc:
+        logger.debug("Cannot answer superseded callback query %s: %s", query.id, exc)
+
+
+async def drain_backlog(application, limit=1000, allowed_updates=None, **policy):
+    """
+    Fetches and confirms up to ``limit`` pending updates, then puts the ones
+    left after ``coalesce`` (with ``policy`` as its options) on the update
+    queue. Returns the number of queued updates.
+    """
+    bot = application.bot
+    started = time.perf_counter()
+    updates = []
+    confirmed = 0
+    offset = None
+    try:
+        while len(updates) < limit:
+            batch = await bot.get_updates(
+                offset=offset,
+                limit=min(BATCH_SIZE, limit - len(updates)),
+                timeout=0,
+                allowed_updates=allowed_updates,
+            )
+            # Запрос с offset подтвердил всё, что было получено раньше
+            confirmed = len(updates)
+            if not batch:
+                break
+            updates += batch
+            offset = batch[-1].update_id + 1
+        else:
+            await bot.get_updates(offset=offset, limit=1, timeout=0, allowed_updates=allowed_updates)
+            confirmed = len(updates)
+    except TelegramError as exc:
+        # Неподтверждённую пачку заново получит Updater
+        logger.warning("Backlog drain stopped early: %s", exc)
+    updates = updates[:confirmed]
+
+    kept, superseded, counts = coalesce(updates, **policy)
+    for update in kept:
+        await application.update_queue.put(update)
+    # Обработчик их не увидит, но кнопка не должна крутиться до истечения запроса
+    await asyncio.gather(*(
+        _answer(bot, update.callback_query) for update in superseded if update.callback_query is not None
+    ))
+
+    DRAINED.inc("dispatched", amount=len(kept))
+    for outcome, count in counts.items():
+        DRAINED.inc(outcome, amount=count)
+    if updates:
+        logger.info(
+            "Backlog drained in %s ms: %s fetched, %s queued, %s coalesced, %s expired",
+            elapsed_ms(started), len(updates), len(kept), counts["coalesced"], counts["expired"],
+        )
+    return len(kept)
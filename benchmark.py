@@ -0,0 +1,490 @@
+"""
+Load-testing harness: replays synthetic traffic through the real Application
+against an in-process stand-in for the Telegram Bot API. No network is used.
+
+    python benchmark.py --users 500 --rounds 4 --latency-ms 30
+    python benchmark.py --mode polling --error-rate 0.01 --json
+    python benchmark.py --strategy sequential --latency-ms 50
+    python benchmark.py --max-p99-ms 50 --min-rate 1000   # exits 1 on regression
+    python benchmark.py --shards 4 --users 2000
+
+Reports updates/s, p50/p99 handler latency, memory per active user and
+outbound Bot API calls per update.
+
+With ``--shards N`` the bot runs as a real sharded deployment: ``bot.py`` is
+started as a subprocess with ``SHARDS=N`` against the same fake Bot API
+served over HTTP on localhost. Latency percentiles then come from the
+front's ``/metrics`` histograms (bucket upper bounds) and memory is not
+reported.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import resource
+import signal
+import socket
+import sys
+import tempfile
+import time
+from collections import Counter, deque
+from types import SimpleNamespace
+
+from telegram.request import BaseRequest
+
+BOT_TOKEN = "123456:benchmark"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+
+# ---------- ПОДДЕЛЬНЫЙ BOT API ----------
+class FakeBotAPIRequest(BaseRequest):
+    """
+    In-process BaseRequest that answers Bot API calls locally.
+
+    Supports getMe, getUpdates (from ``pending_updates``), sendMessage,
+    editMessageText, answerCallbackQuery and the webhook calls, with a
+    configurable artificial latency and a probability of answering 429.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, retry_after=1, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.calls = Counter()
+        self.last_call = None
+        self.pending_updates = deque()
+        self._random = random.Random(seed)
+        self._message_id = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @staticmethod
+    def _ok(result):
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        api_method = url.rpartition("/")[2]
+        params = request_data.parameters if request_data else {}
+        self.calls[api_method] += 1
+
+        if api_method == "getUpdates":
+            return self._ok(await self._get_updates(params))
+        self.last_call = time.perf_counter()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if api_method != "getMe" and self.error_rate and self._random.random() < self.error_rate:
+            self.calls["429"] += 1
+            return 429, json.dumps({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }).encode()
+
+        if api_method == "getMe":
+            return self._ok(BOT_USER)
+        if api_method in ("sendMessage", "editMessageText"):
+            self._message_id += 1
+            chat_id = int(params.get("chat_id", 0))
+            return self._ok({
+                "message_id": int(params.get("message_id", self._message_id)),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            })
+        return self._ok(True)
+
+    async def _get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        while self.pending_updates and self.pending_updates[0]["update_id"] < offset:
+            self.pending_updates.popleft()
+        if not self.pending_updates:
+            await asyncio.sleep(min(float(params.get("timeout") or 0), 0.05))
+            return []
+        limit = int(params.get("limit") or 100)
+        return [self.pending_updates[i] for i in range(min(limit, len(self.pending_updates)))]
+
+
+def fake_api_app(api):
+    """
+    aiohttp application that serves ``api`` (a FakeBotAPIRequest) over HTTP
+    at ``/bot<token>/<method>``, for bots running in other processes.
+    """
+    from aiohttp import web
+
+    async def handle(request):
+        # PTB шлёт параметры формой, значения — строки или JSON
+        params = dict(await request.post()) if request.can_read_body else {}
+        status, body = await api.do_request(
+            request.path, request.method, SimpleNamespace(parameters=params) if params else None)
+        return web.Response(status=status, body=body, content_type="application/json")
+
+    app = web.Application()
+    app.router.add_route("POST", "/bot{token}/{method}", handle)
+    return app
+
+
+# ---------- ГЕНЕРАТОР ТРАФИКА ----------
+class TrafficGenerator:
+    """
+    Produces raw update dicts for many users walking through the bot's menus.
+    """
+
+    def __init__(self, seed=0):
+        import content
+        self.content = content
+        self.random = random.Random(seed)
+        self.update_id = 0
+        self.message_id = 0
+
+    def _user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "language_code": "ru"}
+
+    def message(self, user_id, text):
+        self.update_id += 1
+        self.message_id += 1
+        message = {
+            "message_id": self.message_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": self.update_id, "message": message}
+
+    def callback(self, user_id, data):
+        self.update_id += 1
+        return {
+            "update_id": self.update_id,
+            "callback_query": {
+                "id": str(self.update_id),
+                "chat_instance": str(user_id),
+                "from": self._user(user_id),
+                "data": data,
+                "message": {
+                    "message_id": user_id,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": BOT_USER,
+                    "text": "…",
+                },
+            },
+        }
+
+    def session(self, user_id, rounds):
+        """
+        One user's updates in order: start, begin the journey, then ``rounds``
+        craving flows mixed with stats, settings and the occasional relapse.
+        """
+        content = self.content
+        methods = [key for key, _label, _text in content.COPING_METHODS]
+        yield self.message(user_id, "/start")
+        yield self.message(user_id, content.BTN_START_JOURNEY)
+        for _ in range(rounds):
+            yield self.message(user_id, content.BTN_CRAVING)
+            yield self.callback(user_id, content.callback_data(content.CB_CRAVING_SCALE, self.random.randint(0, 10)))
+            yield self.callback(user_id, content.callback_data(content.CB_CRAVING_METHOD, self.random.choice(methods)))
+            yield self.message(user_id, self.random.choice([content.BTN_STATS, content.BTN_SETTINGS]))
+            if self.random.random() < 0.05:
+                yield self.message(user_id, content.BTN_RELAPSE)
+                yield self.message(user_id, content.BTN_START_JOURNEY)
+
+    def stream(self, users, rounds):
+        """
+        Interleaves the sessions of ``users`` users in random order,
+        preserving each user's own order.
+        """
+        sessions = [self.session(user_id, rounds) for user_id in range(1, users + 1)]
+        while sessions:
+            index = self.random.randrange(len(sessions))
+            try:
+                yield next(sessions[index])
+            except StopIteration:
+                sessions[index] = sessions[-1]
+                sessions.pop()
+
+
+# ---------- ЗАПУСК ----------
+def _rss_bytes():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # ru_maxrss — пиковое значение (КБ в Linux), но лучше, чем ничего
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def run_benchmark(args):
+    import bot
+    from telegram import Update
+    from metrics import METRICS
+
+    api = FakeBotAPIRequest(latency=args.latency_ms / 1000, error_rate=args.error_rate, seed=args.seed)
+    application = bot.build_application(
+        token=BOT_TOKEN,
+        request=api,
+        get_updates_request=api,
+        updater=args.mode == "polling",
+    )
+    latencies = []
+    METRICS.handler_observers.append(lambda handler, seconds: latencies.append(seconds))
+    errors_before = sum(value for _name, _labels, value in METRICS.handler_errors.samples())
+
+    raw_updates = list(TrafficGenerator(args.seed).stream(args.users, args.rounds))
+
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+    warm_up = application.bot_data.get("warm_up")
+    if warm_up is not None:
+        await warm_up
+    # Замер после запуска: импорт NumPy, потоки хранилища и прочие постоянные затраты не делятся на пользователей
+    rss_before = _rss_bytes()
+    api.calls.clear()
+    try:
+        started = time.perf_counter()
+        if args.mode == "polling":
+            api.pending_updates.extend(raw_updates)
+            await application.updater.start_polling(poll_interval=0, timeout=1, allowed_updates=bot.ALLOWED_UPDATES)
+            # Фейк убирает обновления, только когда следующий getUpdates их подтвердил
+            while api.pending_updates:
+                await asyncio.sleep(0.01)
+        else:
+            for raw in raw_updates:
+                await application.update_queue.put(Update.de_json(raw, application.bot))
+        await application.update_queue.join()
+        elapsed = time.perf_counter() - started
+        rss_after = _rss_bytes()
+    finally:
+        if application.updater is not None and application.updater.running:
+            await application.updater.stop()
+        await application.stop()
+        await application.post_shutdown(application)
+        await application.shutdown()
+
+    total = len(raw_updates)
+    errors = sum(value for _name, _labels, value in METRICS.handler_errors.samples()) - errors_before
+    latencies.sort()
+    outbound = {method: count for method, count in sorted(api.calls.items()) if method != "getUpdates"}
+    return {
+        "mode": args.mode,
+        "users": args.users,
+        "updates": total,
+        "elapsed_s": round(elapsed, 3),
+        "updates_per_s": round(total / elapsed, 1),
+        "handler_p50_ms": round(_percentile(latencies, 0.50) * 1000, 3),
+        "handler_p99_ms": round(_percentile(latencies, 0.99) * 1000, 3),
+        "handler_errors": errors,
+        "memory_per_user_bytes": max(0, rss_after - rss_before) // max(1, args.users),
+        "outbound_per_update": round(sum(outbound.values()) / total, 3),
+        "outbound_calls": outbound,
+    }
+
+
+# ---------- ШАРДИРОВАННЫЙ ЗАПУСК ----------
+METRIC_LINE = re.compile(r'^(\w+)(?:\{(.*)\})? (\S+)$')
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _scrape(text, name):
+    """
+    Returns ``[(labels, value)]`` for every sample of ``name`` in Prometheus text.
+    """
+    samples = []
+    for line in text.splitlines():
+        match = METRIC_LINE.match(line)
+        if match and match.group(1) == name:
+            labels = dict(re.findall(r'(\w+)="([^"]*)"', match.group(2) or ""))
+            samples.append((labels, float(match.group(3))))
+    return samples
+
+
+def _histogram_quantile(text, name, fraction):
+    """
+    Upper bound of the bucket holding the ``fraction`` quantile, over all series of ``name``.
+    """
+    buckets = Counter()
+    for labels, value in _scrape(text, f"{name}_bucket"):
+        buckets[float(labels["le"])] += value
+    if not buckets:
+        return 0.0
+    bounds = sorted(buckets)
+    target = fraction * buckets[bounds[-1]]
+    return next(bound for bound in bounds if buckets[bound] >= target)
+
+
+async def run_sharded_benchmark(args):
+    """
+    Runs ``bot.py`` with ``SHARDS=args.shards`` against the fake Bot API over
+    HTTP and reports throughput, latency and outbound calls from outside.
+    """
+    import aiohttp
+    from aiohttp import web
+
+    api = FakeBotAPIRequest(latency=args.latency_ms / 1000, error_rate=args.error_rate, seed=args.seed)
+    raw_updates = list(TrafficGenerator(args.seed).stream(args.users, args.rounds))
+    total = len(raw_updates)
+    api_port, metrics_port = _free_port(), _free_port()
+    runner = web.AppRunner(fake_api_app(api), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", api_port).start()
+
+    env = dict(
+        os.environ,
+        SHARDS=str(args.shards),
+        BOT_TOKEN=BOT_TOKEN,
+        BOT_API_URL=f"http://127.0.0.1:{api_port}/bot",
+        BOT_MODE="polling",
+        WEB_SERVER="1",
+        HOST="127.0.0.1",
+        PORT=str(metrics_port),
+        # Прореживание очереди изменило бы число обработанных обновлений
+        BACKLOG_DRAIN="0",
+        SHARD_STATS_INTERVAL="0.5",
+    )
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+    process = await asyncio.create_subprocess_exec(sys.executable, script, env=env)
+    metrics_url = f"http://127.0.0.1:{metrics_port}/metrics"
+    try:
+        async with aiohttp.ClientSession() as session:
+
+            async def scrape():
+                async with session.get(metrics_url) as response:
+                    return await response.text()
+
+            async def handled():
+                samples = _scrape(await scrape(), "bot_handler_latency_seconds_count")
+                return sum(value for labels, value in samples if "shard" in labels)
+
+            # Ждём, пока фронт начнёт опрашивать getUpdates и поднимет /metrics
+            deadline = time.monotonic() + 60
+            while True:
+                if process.returncode is not None:
+                    raise RuntimeError(f"bot.py exited with code {process.returncode}")
+                if time.monotonic() > deadline:
+                    raise RuntimeError("Sharded bot did not start in time")
+                try:
+                    if api.calls["getUpdates"]:
+                        await scrape()
+                        break
+                except aiohttp.ClientError:
+                    pass
+                await asyncio.sleep(0.1)
+
+            api.calls.clear()
+            started = time.perf_counter()
+            api.pending_updates.extend(raw_updates)
+            # Метрики обработчиков приходят от шардов раз в SHARD_STATS_INTERVAL
+            while await handled() < total:
+                if process.returncode is not None:
+                    raise RuntimeError(f"bot.py exited with code {process.returncode}")
+                await asyncio.sleep(0.2)
+            elapsed = (api.last_call or time.perf_counter()) - started
+            text = await scrape()
+    finally:
+        if process.returncode is None:
+            process.send_signal(signal.SIGINT)
+            try:
+                await asyncio.wait_for(process.wait(), timeout=30)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+        await runner.cleanup()
+
+    errors = sum(value for labels, value in _scrape(text, "bot_handler_errors_total") if "shard" in labels)
+    outbound = {method: count for method, count in sorted(api.calls.items()) if method != "getUpdates"}
+    return {
+        "mode": "sharded",
+        "shards": args.shards,
+        "users": args.users,
+        "updates": total,
+        "elapsed_s": round(elapsed, 3),
+        "updates_per_s": round(total / elapsed, 1),
+        "handler_p50_ms": round(_histogram_quantile(text, "bot_handler_latency_seconds", 0.50) * 1000, 3),
+        "handler_p99_ms": round(_histogram_quantile(text, "bot_handler_latency_seconds", 0.99) * 1000, 3),
+        "handler_errors": int(errors),
+        "shard_updates": {
+            labels["shard"]: int(value) for labels, value in _scrape(text, "bot_shard_routed_total")
+        },
+        "outbound_per_update": round(sum(outbound.values()) / total, 3),
+        "outbound_calls": outbound,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=4, help="craving flows per user")
+    parser.add_argument("--mode", choices=("queue", "polling"), default="queue",
+                        help="feed update_queue directly or go through getUpdates polling")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="artificial Bot API latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with 429")
+    parser.add_argument("--concurrency", type=int, default=None, help="overrides UPDATE_CONCURRENCY")
+    parser.add_argument("--strategy", choices=("sequential", "concurrent", "edit"), default=None,
+                        help="overrides RESPONSE_STRATEGY for callback handlers")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="run bot.py with SHARDS=N as subprocesses against a fake Bot API over HTTP")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--max-p99-ms", type=float, default=None, help="fail if p99 handler latency exceeds this")
+    parser.add_argument("--min-rate", type=float, default=None, help="fail if updates/s falls below this")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # bot.py читает конфигурацию из окружения при импорте
+    workdir = tempfile.mkdtemp(prefix="alcofree-bench-")
+    os.environ["DB_PATH"] = os.path.join(workdir, "bench.db")
+    os.environ["WEB_SERVER"] = "0"
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    # Ошибки обработчиков (например, от внедрённых 429) считаются в отчёте, а не печатаются
+    os.environ.setdefault("LOG_LEVELS", "telegram.ext.Application=CRITICAL")
+    if args.concurrency is not None:
+        os.environ["UPDATE_CONCURRENCY"] = str(args.concurrency)
+    if args.strategy is not None:
+        os.environ["RESPONSE_STRATEGY"] = args.strategy
+
+    from logging_setup import setup_logging
+    setup_logging()
+
+    report = asyncio.run(run_sharded_benchmark(args) if args.shards > 1 else run_benchmark(args))
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False))
+    else:
+        for key, value in report.items():
+            print(f"{key:>24}: {value}")
+
+    failures = []
+    if args.max_p99_ms is not None and report["handler_p99_ms"] > args.max_p99_ms:
+        failures.append(f"p99 {report['handler_p99_ms']} ms > {args.max_p99_ms} ms")
+    if args.min_rate is not None and report["updates_per_s"] < args.min_rate:
+        failures.append(f"{report['updates_per_s']} updates/s < {args.min_rate}")
+    for failure in failures:
+        print(f"REGRESSION: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,251 +1,349 @@
 import os
+import asyncio
+import importlib
 import logging
-from threading import Thread
-try:
-    from flask import Flask
-except ImportError:
-    Flask = None
+import secrets
+import signal
+import time
+from functools import wraps
 
-from telegram import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters
 
+import content
+import cravings
+from backlog import drain_backlog
+from content import TEXTS, KEYBOARD_JSON
+from logging_setup import setup_logging, log_context, reset_context
+from metrics import METRICS
+from reminders import ReminderScheduler, SendQueue
+from responses import DEBOUNCED, TapDebouncer, answer_callback, parse_strategies, run_callback
+from storage import UserStore
+from transport import BotAPIRequest, parse_method_timeouts
+from update_processor import PerUserUpdateProcessor
+
 # Конфигурация
 BOT_TOKEN = os.environ.get('BOT_TOKEN', '8336691136:AAGo_htB8Shysi6AW0p3ZpJvyGtJb8TJF3E')
+# Адрес Bot API; можно указать локальный сервер (например, для нагрузочных тестов)
+BOT_API_URL = os.environ.get('BOT_API_URL', 'https://api.telegram.org/bot')
 WEB_PORT = int(os.environ.get('PORT', 10000))
+WEB_HOST = os.environ.get('HOST', '0.0.0.0')
+# Режим получения обновлений: 'polling' или 'webhook'
+BOT_MODE = os.environ.get('BOT_MODE', 'polling').lower()
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL', os.environ.get('RENDER_EXTERNAL_URL', '')).rstrip('/')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+ALLOWED_UPDATES = ["message", "callback_query"]
+WEB_SERVER_ENABLED = os.environ.get('WEB_SERVER', '1') != '0'
+# Число процессов-обработчиков; при SHARDS > 1 бот запускается в шардированном режиме
+SHARDS = int(os.environ.get('SHARDS', 1))
+DB_PATH = os.environ.get('DB_PATH', 'alcofree.db')
+STORE_CACHE_SIZE = int(os.environ.get('STORE_CACHE_SIZE', 10000))
+STORE_FLUSH_INTERVAL = float(os.environ.get('STORE_FLUSH_INTERVAL', 1.0))
+# Сколько пользователей обрабатываются параллельно (обновления одного пользователя — строго по очереди)
+UPDATE_CONCURRENCY = int(os.environ.get('UPDATE_CONCURRENCY', 16))
+UPDATE_MAX_PENDING = int(os.environ.get('UPDATE_MAX_PENDING', 10000))
+REMINDER_TICK = float(os.environ.get('REMINDER_TICK', 30))
+# Уровень записи «Handled update» с latency_ms; если он отключён, запись не строится вовсе
+HANDLER_LOG_LEVEL = logging.getLevelName(os.environ.get('HANDLER_LOG_LEVEL', 'INFO').upper())
+# Сколько напоминаний может ждать в очереди отправки; остальные остаются в расписании
+REMINDER_MAX_BACKLOG = int(os.environ.get('REMINDER_MAX_BACKLOG', 1000))
+# Лимиты Telegram: ~30 сообщений/с всего и 1 сообщение/с в один чат.
+# Рассылка берёт только половину общего лимита: у всех по умолчанию 09:00,
+# и утренний пик не должен оставлять без ответа тех, кто пишет боту
+BROADCAST_RATE = float(os.environ.get('BROADCAST_RATE', 15))
+BROADCAST_CHAT_INTERVAL = float(os.environ.get('BROADCAST_CHAT_INTERVAL', 1.0))
+# После перезапуска накопившиеся обновления забираются пачками и прореживаются до старта polling.
+# Каждые 100 обновлений лимита — ещё один запрос до первого ответа; остальное получит Updater
+BACKLOG_DRAIN = os.environ.get('BACKLOG_DRAIN', '1') != '0'
+BACKLOG_LIMIT = int(os.environ.get('BACKLOG_LIMIT', 100))
+# Нажатия на inline-кнопки старше этого (секунды) уже не ответить — их отбрасываем
+CALLBACK_MAX_AGE = float(os.environ.get('CALLBACK_MAX_AGE', 30))
+# При polling веб-сервер и NumPy ждут первого getUpdates, но не дольше этого (секунды):
+# без разбора очереди его делает Updater, а на пустой очереди он висит весь long poll
+WARM_UP_MAX_WAIT = float(os.environ.get('WARM_UP_MAX_WAIT', 2))
+# Как отвечать на нажатия inline-кнопок: sequential, concurrent или edit (см. responses.py);
+# для отдельных обработчиков — RESPONSE_STRATEGIES="craving_method_selected=concurrent"
+RESPONSE_STRATEGY = os.environ.get('RESPONSE_STRATEGY', 'edit')
+RESPONSE_STRATEGIES = parse_strategies(os.environ.get('RESPONSE_STRATEGIES', ''))
+# Повтор того же нажатия в течение этого времени (секунды) только гасит индикатор загрузки
+CALLBACK_DEBOUNCE = float(os.environ.get('CALLBACK_DEBOUNCE', 1.0))
+# Сколько держать запрос вебхука с нажатием, чтобы ответить на него в теле ответа (0 — не держать)
+WEBHOOK_REPLY_TIMEOUT = float(os.environ.get('WEBHOOK_REPLY_TIMEOUT', 0.5))
+# HTTP-клиент Bot API: отдельные пулы для getUpdates и для исходящих вызовов
+API_POOL_SIZE = int(os.environ.get('API_POOL_SIZE', 256))
+API_POLL_POOL_SIZE = int(os.environ.get('API_POLL_POOL_SIZE', 1))
+API_POOL_TIMEOUT = float(os.environ.get('API_POOL_TIMEOUT', 5.0))
+API_CONNECT_TIMEOUT = float(os.environ.get('API_CONNECT_TIMEOUT', 5.0))
+API_READ_TIMEOUT = float(os.environ.get('API_READ_TIMEOUT', 5.0))
+API_KEEPALIVE_EXPIRY = float(os.environ.get('API_KEEPALIVE_EXPIRY', 60.0))
+API_HTTP2 = os.environ.get('API_HTTP2', '0') != '0'
+# Таймауты чтения по методам, например "sendMessage=10,answerCallbackQuery=3"
+API_TIMEOUTS = parse_method_timeouts(os.environ.get('API_TIMEOUTS', 'answerCallbackQuery=3'))
 
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-# ---------- КЛАВИАТУРЫ ----------
-def get_main_keyboard():
+# ---------- ФОРМАТИРОВАНИЕ ----------
+def plural_ru(n, one, few, many):
     """
-    Returns the main reply keyboard markup for the bot's primary actions.
+    Picks the Russian plural form for ``n`` (e.g. день / дня / дней).
     """
-    return ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="Тяга сейчас"), KeyboardButton(text="Моя статистика")],
-            [KeyboardButton(text="Сорвался(ась)"), KeyboardButton(text="Настройки")]
-        ],
-        resize_keyboard=True
-    )
+    n = abs(n) % 100
+    if 11 <= n <= 14:
+        return many
+    n %= 10
+    if n == 1:
+        return one
+    if 2 <= n <= 4:
+        return few
+    return many
+
+def format_reminders(record):
+    """
+    Describes the reminder setting of ``record`` for the settings screen.
+    """
+    if not record.reminders_enabled:
+        return "выключены"
+    hours, minutes = divmod(record.reminder_time, 60)
+    return f"включены, в {hours:02d}:{minutes:02d}"
 
-def get_intro_keyboard():
+def render_reminder(record, now=None):
     """
-    Returns the introductory reply keyboard markup for starting the journey.
+    Builds the daily reminder text for ``record``.
     """
-    return ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="В путь в трезвую жизнь")]
-        ],
-        resize_keyboard=True
+    if not record.journey_active:
+        return TEXTS["reminder_not_started"].format(btn_start=content.BTN_START_JOURNEY)
+    days = record.stats(now)["days"]
+    return TEXTS["reminder"].format(
+        days=days,
+        days_word=plural_ru(days, "день", "дня", "дней"),
+        btn_craving=content.BTN_CRAVING,
     )
 
-def get_craving_scale_keyboard():
-    """
-    Returns an inline keyboard for rating craving intensity from 0 to 10.
-    """
-    return InlineKeyboardMarkup([
-        [
-            InlineKeyboardButton("0", callback_data="craving_scale_0"),
-            InlineKeyboardButton("1", callback_data="craving_scale_1"),
-            InlineKeyboardButton("2", callback_data="craving_scale_2"),
-            InlineKeyboardButton("3", callback_data="craving_scale_3"),
-            InlineKeyboardButton("4", callback_data="craving_scale_4"),
-            InlineKeyboardButton("5", callback_data="craving_scale_5"),
-        ],
-        [
-            InlineKeyboardButton("6", callback_data="craving_scale_6"),
-            InlineKeyboardButton("7", callback_data="craving_scale_7"),
-            InlineKeyboardButton("8", callback_data="craving_scale_8"),
-            InlineKeyboardButton("9", callback_data="craving_scale_9"),
-            InlineKeyboardButton("10", callback_data="craving_scale_10"),
-        ],
-    ])
-
-
-def get_craving_methods_keyboard():
-    """
-    Returns an inline keyboard with different coping method options for cravings.
-    """
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("Дыхание", callback_data="craving_method_breath")],
-        [InlineKeyboardButton("Стакан воды", callback_data="craving_method_water")],
-        [InlineKeyboardButton("Движение/упражнение", callback_data="craving_method_move")],
-        [InlineKeyboardButton("Позвонить другу", callback_data="craving_method_call")],
-        [InlineKeyboardButton("Переключить внимание", callback_data="craving_method_focus")],
-    ])
+def parse_reminder_time(value):
+    """
+    Parses ``HH:MM`` into minutes after midnight; returns None if invalid.
+    """
+    hours, sep, minutes = value.partition(":")
+    if not sep or not hours.isdigit() or not minutes.isdigit():
+        return None
+    hours, minutes = int(hours), int(minutes)
+    if hours > 23 or minutes > 59:
+        return None
+    return hours * 60 + minutes
+
+# ---------- ИНСТРУМЕНТАЦИЯ ----------
+def instrument(handler):
+    """
+    Wraps a top-level handler: tags log records with the user id and handler
+    name, logs the handler latency at HANDLER_LOG_LEVEL and records it in METRICS.
+    """
+    name = handler.__name__
+
+    @wraps(handler)
+    async def wrapper(update, context):
+        user = update.effective_user
+        user_id = user.id if user else None
+        tokens = log_context(name, user_id)
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = await handler(update, context)
+            failed = False
+            return result
+        finally:
+            seconds = time.perf_counter() - started
+            METRICS.observe_handler(name, seconds, user_id, failed)
+            if logger.isEnabledFor(HANDLER_LOG_LEVEL):
+                logger.log(HANDLER_LOG_LEVEL, "Handled update %s", update.update_id,
+                           extra={"latency_ms": round(seconds * 1000, 2)})
+            reset_context(tokens)
+
+    return wrapper
+
+def format_craving_stats(series, tz_offset, now=None):
+    """
+    Renders the craving section of the stats screen; empty if nothing was recorded.
+    """
+    if not len(series):
+        return ""
+    report = cravings.analyze(series, now, tz_offset)
+    parts = [TEXTS["stats_cravings_header"].format(**report)]
+    for days, key in ((7, "last_7_days"), (30, "last_30_days")):
+        window = report[key]
+        if not window["count"]:
+            continue
+        trend = ""
+        if window["trend"] is not None and abs(window["trend"]) >= 0.1:
+            template = "stats_cravings_trend_down" if window["trend"] < 0 else "stats_cravings_trend_up"
+            trend = TEXTS[template].format(delta=abs(window["trend"]))
+        parts.append(TEXTS["stats_cravings_window"].format(
+            days=days,
+            count=window["count"],
+            times_word=plural_ru(window["count"], "раз", "раза", "раз"),
+            average=window["average"],
+            peak=window["peak"],
+            trend=trend,
+        ))
+    heatmap = report["heatmap"]
+    parts.append(TEXTS["stats_cravings_hour"].format(hour=heatmap.index(max(heatmap))))
+    if report["best_method"] is not None:
+        parts.append(TEXTS["stats_cravings_best_method"].format(method=content.METHOD_LABELS[report["best_method"]]))
+    return "".join(parts)
 
 # ---------- КОМАНДЫ БОТА ----------
 async def start(update, context):
     """
     Handles the /start command. Sends a welcome message and intro keyboard.
     """
-    logger.info(f"User {update.effective_user.id} started the bot")
-    await update.message.reply_text(
-        "Привет! Я бот, который помогает работать с алкогольной тягой.\n\n"
-        "⚠️ Я не врач и не заменяю лечение.\n"
-        "Нажми «В путь в трезвую жизнь», чтобы начать.",
-        reply_markup=get_intro_keyboard()
-    )
+    logger.info("User %s started the bot", update.effective_user.id)
+    await update.message.reply_text(TEXTS["welcome"], reply_markup=KEYBOARD_JSON["intro"])
 
 async def start_journey(update, context):
     """
     Handles the start of the sobriety journey and shows the main keyboard.
     """
-    logger.info(f"User {update.effective_user.id} started journey")
-    await update.message.reply_text(
-        "Отлично! Трекер трезвости запущен. 🎉\n\n"
-        "Теперь ты можешь:\n"
-        "• Отслеживать дни трезвости\n"
-        "• Получать помощь при тяге\n"
-        "• Видеть свою статистику\n\n"
-        "Используй кнопки ниже:",
-        reply_markup=get_main_keyboard()
-    )
+    logger.info("User %s started journey", update.effective_user.id)
+    record = await context.bot_data["store"].start_journey(update.effective_user.id)
+    reminders = context.bot_data.get("reminders")
+    if reminders is not None:
+        reminders.schedule(record)
+    await update.message.reply_text(TEXTS["journey_started"], reply_markup=KEYBOARD_JSON["main"])
 
 async def stats_command(update, context):
     """
     Sends the user's sobriety statistics.
     """
-    logger.info(f"User {update.effective_user.id} requested stats")
-    stats_text = """
-🎉 ТРЕЗВОСТЬ: 1 ДЕНЬ
-
-💰 Сэкономлено денег: 500 руб
-⏰ Сэкономлено времени: 2 часов
-📈 Улучшение здоровья: +2%
+    logger.info("User %s requested stats", update.effective_user.id)
+    record = await context.bot_data["store"].get(update.effective_user.id)
+    if not record.journey_active:
+        await update.message.reply_text(TEXTS["stats_not_started"], reply_markup=KEYBOARD_JSON["intro"])
+        return
 
-Ты делаешь огромные шаги! 💪
-"""
+    stats = record.stats()
+    stats_text = TEXTS["stats"].format(
+        days_word=plural_ru(stats["days"], "ДЕНЬ", "ДНЯ", "ДНЕЙ"),
+        hours_word=plural_ru(stats["hours_saved"], "час", "часа", "часов"),
+        **stats
+    )
+    series = await context.bot_data["store"].get_cravings(record.user_id)
+    stats_text += format_craving_stats(series, record.tz_offset)
     await update.message.reply_text(stats_text)
 
 async def craving_handler(update, context):
     """
     Provides help and advice for handling alcohol cravings.
     """
-    logger.info(f"User {update.effective_user.id} has craving")
-    await update.message.reply_text(
-        "🆘 ПОМОЩЬ ПРИ ТЯГЕ\n\n"
-        "Оцени, пожалуйста, силу тяги по шкале от 0 до 10.\n"
-        "0 — совсем не тянет, 10 — очень сильное желание выпить.\n\n"
-        "Нажми на одну из кнопок ниже:",
-        reply_markup=get_craving_scale_keyboard()
-    )
+    logger.info("User %s has craving", update.effective_user.id)
+    await update.message.reply_text(TEXTS["craving_prompt"], reply_markup=KEYBOARD_JSON["craving_scale"])
 
+async def craving_scale_selected(update, context, arg):
+    """
+    Handles craving_scale_X (X = 0..10): asks to choose a coping method.
+    Returns the response for the callback strategy.
+    """
+    query = update.callback_query
+    try:
+        level = int(arg)
+    except ValueError:
+        level = None
+    text = content.CRAVING_LEVEL_TEXTS.get(level)
+    if text is None:
+        logger.warning("Invalid craving scale data: %s", query.data)
+        return None
+
+    user_id = query.from_user.id if query.from_user else None
+    logger.info("User %s selected craving level %s", user_id, level)
+    if user_id is not None:
+        await context.bot_data["store"].record_craving(user_id, level)
+    return text, KEYBOARD_JSON["craving_methods"]
+
+async def craving_method_selected(update, context, arg):
+    """
+    Handles craving_method_*: returns a detailed description of the chosen method.
+    """
+    query = update.callback_query
+    logger.info("User %s selected method %s", query.from_user.id if query.from_user else "unknown", arg)
+    text = content.METHOD_TEXTS.get(arg, TEXTS["method_unknown"])
+    method_code = content.METHOD_CODES.get(arg)
+    if method_code is not None and query.from_user:
+        await context.bot_data["store"].record_craving_method(query.from_user.id, method_code)
+    return text, KEYBOARD_JSON["craving_methods"]
 
 async def craving_callback(update, context):
     """
-    Unified callback handler for craving-related inline buttons.
-    Handles:
-    - craving_scale_X  (X = 0..10)  -> asks to choose a coping method
-    - craving_method_* -> sends detailed description of the chosen method
+    Unified callback handler for inline buttons.
+    Routes ``<prefix>_<arg>`` callback data through CALLBACK_ROUTES and
+    delivers the result with the handler's response strategy.
     """
     query = update.callback_query
-    await query.answer()
     data = query.data or ""
 
-    logger.info(f"Callback data received: {data}")
+    logger.debug("Callback data received: %s", data)
 
-    # --- Scale selection: craving_scale_0..10 ---
-    if data.startswith("craving_scale_"):
-        try:
-            level = int(data.split("_")[-1])
-        except (ValueError, IndexError):
-            logger.warning(f"Invalid craving scale data: {data}")
-            return
-
-        user_id = query.from_user.id if query.from_user else None
-        logger.info(f"User {user_id} selected craving level {level}")
-
-        if level <= 3:
-            text = (
-                f"Ты отметил(а) тягу на уровне {level}/10.\n\n"
-                "Тяга сейчас слабая — это хороший знак. Всё равно важно позаботиться о себе.\n"
-                "Выбери ниже способ, который хочешь попробовать:"
-            )
-        elif level <= 7:
-            text = (
-                f"Ты отметил(а) тягу на уровне {level}/10.\n\n"
-                "Тяга уже ощутимая. Давай выберем одно из упражнений, чтобы её снизить.\n"
-                "Выбери способ ниже:"
-            )
-        else:
-            text = (
-                f"Ты отметил(а) очень сильную тягу: {level}/10.\n\n"
-                "Это тяжело, но это состояние пройдет. Сейчас важно сделать хотя бы один маленький шаг.\n"
-                "Выбери способ, который готов(а) попробовать прямо сейчас:"
-            )
-
-        await query.message.reply_text(
-            text,
-            reply_markup=get_craving_methods_keyboard()
-        )
+    prefix, _, arg = data.rpartition("_")
+    handler = CALLBACK_ROUTES.get(prefix)
+    if handler is None:
+        logger.warning("Unknown callback data received: %s", data)
+        await answer_callback(update, context)
         return
-
-    # --- Methods selection: craving_method_* ---
-    if data.startswith("craving_method_"):
-        method_key = data.split("_", 2)[-1]  # "breath", "water", "move", "call", "focus"
-        logger.info(f"User {query.from_user.id if query.from_user else 'unknown'} selected method {method_key}")
-
-        if method_key == "breath":
-            text = (
-                "🧘 Упражнение «Дыхание 4–7–8»\n\n"
-                "1. Вдохни через нос на 4 счёта.\n"
-                "2. Задержи дыхание на 7 счётов.\n"
-                "3. Медленно выдыхай через рот на 8 счётов.\n\n"
-                "Сделай так 4 цикла. Это помогает снизить напряжение и сигнализирует мозгу, что опасности нет."
-            )
-        elif method_key == "water":
-            text = (
-                "💧 Стакан воды\n\n"
-                "Налей стакан холодной воды и выпей его небольшими глотками.\n"
-                "Сосредоточься на ощущениях: как вода проходит по горлу, какая она на вкус, какая температура.\n\n"
-                "Это переключает внимание и помогает телу почувствовать себя лучше."
-            )
-        elif method_key == "move":
-            text = (
-                "🏃 Движение/упражнение\n\n"
-                "Выбери любое простое движение: приседания, отжимания, быстрая ходьба по комнате, растяжка.\n"
-                "Сделай 10–20 повторений или 3–5 минут движения.\n\n"
-                "Тело сбрасывает напряжение, и тяга часто уменьшается."
-            )
-        elif method_key == "call":
-            text = (
-                "📞 Позвонить другу\n\n"
-                "Позвони человеку, который может поддержать. Скажи честно, что тебе сейчас тяжело.\n"
-                "Даже 5 минут разговора могут сильно снизить тягу.\n\n"
-                "Если нет подходящего человека — можно написать сообщение самому себе или в дневник."
-            )
-        elif method_key == "focus":
-            text = (
-                "🎯 Переключить внимание\n\n"
-                "Выбери занятие, которое может увлечь: сериал, игра, книга, музыка, уборка, душ.\n"
-                "Поставь таймер на 15–20 минут и полностью уйди в это занятие.\n\n"
-                "Обычно к концу этого времени волна тяги заметно снижается."
-            )
-        else:
-            text = "Выбери один из доступных способов борьбы с тягой ниже."
-
-        await query.message.reply_text(
-            text,
-            reply_markup=get_craving_methods_keyboard()
-        )
+    message_id = query.message.message_id if query.message is not None else None
+    if query.from_user and DEBOUNCER.is_repeat(query.from_user.id, (message_id, data)):
+        logger.debug("Repeated tap on %s ignored", data)
+        DEBOUNCED.inc()
+        await answer_callback(update, context)
         return
-
-    # Fallback: unknown callback
-    logger.warning(f"Unknown callback data received: {data}")
+    strategy = RESPONSE_STRATEGIES.get(handler.__name__, RESPONSE_STRATEGY)
+    await run_callback(update, context, handler, arg, strategy)
 
 async def relapse_handler(update, context):
     """
     Handles user relapse events and offers encouragement to start again.
     """
-    logger.info(f"User {update.effective_user.id} relapsed")
-    await update.message.reply_text(
-        "Не осуждаю тебя 🙏\n"
-        "Это не конец, а опыт. Ты справишься.\n\n"
-        "Нажми «В путь в трезвую жизнь», чтобы начать заново.",
-        reply_markup=get_intro_keyboard()
+    logger.info("User %s relapsed", update.effective_user.id)
+    await context.bot_data["store"].record_relapse(update.effective_user.id)
+    await update.message.reply_text(TEXTS["relapse"], reply_markup=KEYBOARD_JSON["intro"])
+
+async def settings_handler(update, context):
+    """
+    Shows the user's current settings.
+    """
+    record = await context.bot_data["store"].get(update.effective_user.id)
+    text = TEXTS["settings"].format(
+        tracker="активен" if record.journey_active else "не запущен",
+        reminders=format_reminders(record),
     )
+    await update.message.reply_text(text, reply_markup=KEYBOARD_JSON["main"])
+
+async def reminder_command(update, context):
+    """
+    Handles /reminder HH:MM | on | off to configure daily reminders.
+    """
+    arg = context.args[0].lower() if context.args else ""
+    store = context.bot_data["store"]
+    record = await store.get(update.effective_user.id)
+    if arg == "off":
+        record.reminders_enabled = 0
+    elif arg == "on":
+        record.reminders_enabled = 1
+    else:
+        minutes = parse_reminder_time(arg)
+        if minutes is None:
+            await update.message.reply_text(TEXTS["reminder_usage"])
+            return
+        record.reminder_time = minutes
+        record.reminders_enabled = 1
+
+    logger.info("User %s set reminders: %s", record.user_id, format_reminders(record))
+    store.mark_dirty(record)
+    reminders = context.bot_data.get("reminders")
+    if reminders is not None:
+        reminders.schedule(record)
+    await update.message.reply_text(TEXTS["reminder_updated"].format(reminders=format_reminders(record)))
+
+async def fallback_handler(update, context):
+    """
+    Replies to any text that is not a menu button.
+    """
+    await update.message.reply_text(TEXTS["fallback"], reply_markup=KEYBOARD_JSON["main"])
 
 async def handle_message(update, context):
     """
@@ -254,87 +352,309 @@ async def handle_message(update, context):
     user_id = update.effective_user.id
     text = update.message.text
     
-    logger.info(f"User {user_id} sent: {text}")
-    
-    if text == "В путь в трезвую жизнь":
-        await start_journey(update, context)
-    elif text == "Моя статистика":
-        await stats_command(update, context)
-    elif text == "Тяга сейчас":
-        await craving_handler(update, context)
-    elif text == "Сорвался(ась)":
-        await relapse_handler(update, context)
-    elif text == "Настройки":
-        await update.message.reply_text(
-            "Настройки:\n"
-            "• Трекер трезвости: активен\n"
-            "• Ежедневные уведомления: включены\n"
-            "• Статистика: собирается\n\n"
-            "В будущих версиях здесь можно будет настроить время уведомлений и цели.",
-            reply_markup=get_main_keyboard()
-        )
-    else:
-        await update.message.reply_text("Используй кнопки меню 👇", reply_markup=get_main_keyboard())
+    logger.debug("User %s sent: %s", user_id, text)
+
+    handler = TEXT_ROUTES.get(text, fallback_handler)
+    await handler(update, context)
+
+# ---------- МАРШРУТЫ ----------
+# Таблицы строятся один раз при импорте: подпись кнопки / префикс callback -> обработчик
+TEXT_ROUTES = {
+    content.BTN_START_JOURNEY: start_journey,
+    content.BTN_STATS: stats_command,
+    content.BTN_CRAVING: craving_handler,
+    content.BTN_RELAPSE: relapse_handler,
+    content.BTN_SETTINGS: settings_handler,
+}
+
+CALLBACK_ROUTES = {
+    content.CB_CRAVING_SCALE: craving_scale_selected,
+    content.CB_CRAVING_METHOD: craving_method_selected,
+}
+
+DEBOUNCER = TapDebouncer(CALLBACK_DEBOUNCE)
+
+# Повторные нажатия этих кнопок подряд дают тот же ответ — в накопившейся очереди достаточно последнего
+REPEATABLE_TEXTS = frozenset({
+    content.BTN_START_JOURNEY,
+    content.BTN_STATS,
+    content.BTN_CRAVING,
+    content.BTN_SETTINGS,
+})
+# Новое нажатие с этим префиксом на той же клавиатуре отменяет прежнее
+SUPERSEDED_CALLBACKS = frozenset({content.CB_CRAVING_SCALE})
 
 # ---------- ВЕБ-СЕРВЕР ДЛЯ RENDER ----------
-if Flask is not None:
-    web_app = Flask(__name__)
-
-    @web_app.route('/')
-    def home():
-        return "🤖 Бот трезвости работает! Открой Telegram и напиши /start"
-
-    @web_app.route('/health')
-    def health():
-        return "OK", 200
-
-    def run_web_server():
-        """
-        Starts the Flask web server for health checks and Render deployment.
-        """
-        logger.info(f"Starting web server on port {WEB_PORT}")
-        web_app.run(host='0.0.0.0', port=WEB_PORT, debug=False)
-else:
-    web_app = None
-
-    def run_web_server():
-        """
-        Fallback web server stub when Flask is not installed.
-        Does nothing, allowing the bot to run in polling mode only.
-        """
-        logger.warning("Flask is not installed; web server is disabled.")
+def create_web_server(application):
+    """
+    Creates the web server for health checks and, in webhook mode, Telegram updates.
+    Returns None when aiohttp is not installed.
+    """
+    # aiohttp импортируется только здесь, чтобы не замедлять старт
+    from webserver import WebServer, web
+    if web is None:
+        logger.warning("aiohttp is not installed; web server is disabled.")
+        return None
+    webhook_path = f"/{WEBHOOK_SECRET}" if BOT_MODE == "webhook" else None
+    return WebServer(
+        application,
+        host=WEB_HOST,
+        port=WEB_PORT,
+        webhook_path=webhook_path,
+        secret_token=WEBHOOK_SECRET,
+        metrics=METRICS,
+        # В шардированном режиме обработчики живут в других процессах и ответить в вебхук не могут
+        reply_timeout=WEBHOOK_REPLY_TIMEOUT if webhook_path and SHARDS == 1 else 0.0,
+    )
+
+# ---------- ЖИЗНЕННЫЙ ЦИКЛ ----------
+async def start_reminders(application, store):
+    """
+    Loads the reminder schedule and registers a single repeating tick job.
+    The scheduler is published before loading, so settings changed meanwhile
+    are scheduled too.
+    """
+    if application.job_queue is None:
+        logger.warning("JobQueue is not available (install python-telegram-bot[job-queue]); reminders are disabled.")
+        return
+
+    async def disable_reminders(chat_id):
+        # Пользователь заблокировал бота — больше не пытаемся ему писать
+        record = await store.get(chat_id)
+        record.reminders_enabled = 0
+        store.mark_dirty(record)
+        scheduler.schedule(record)
+
+    send_queue = SendQueue(
+        application.bot,
+        global_rate=BROADCAST_RATE,
+        per_chat_interval=BROADCAST_CHAT_INTERVAL,
+        on_forbidden=disable_reminders,
+        # Следующее напоминание планируется только по итогу отправки текущего
+        on_sent=lambda chat_id: scheduler.sent(chat_id),
+        on_failed=lambda chat_id: scheduler.failed(chat_id),
+        render=lambda chat_id: scheduler.render_due(chat_id),
+    )
+    scheduler = ReminderScheduler(store, send_queue, render_reminder, max_backlog=REMINDER_MAX_BACKLOG)
+    application.bot_data["reminders"] = scheduler
+    await scheduler.load()
+    send_queue.start()
+    application.bot_data["send_queue"] = send_queue
+    application.job_queue.run_repeating(scheduler.tick, interval=REMINDER_TICK, first=REMINDER_TICK, name="reminders")
+
+async def start_web_server(application):
+    web_server = create_web_server(application)
+    if web_server is not None:
+        await web_server.start()
+        application.bot_data["web_server"] = web_server
+
+async def warm_up(application, polling):
+    """
+    Starts what the first replies do not need: the web server, NumPy and the
+    reminder schedule. When polling, waits for the first getUpdates (or
+    WARM_UP_MAX_WAIT) first.
+    """
+    # Тяжёлые импорты — в потоке, чтобы не задерживать обработку первых обновлений
+    loop = asyncio.get_running_loop()
+    if polling:
+        # С BACKLOG_DRAIN первый getUpdates уже сделан в post_init, иначе его делает Updater
+        try:
+            await asyncio.wait_for(METRICS.fetched.wait(), WARM_UP_MAX_WAIT)
+        except asyncio.TimeoutError:
+            pass
+        if WEB_SERVER_ENABLED:
+            await loop.run_in_executor(None, importlib.import_module, "webserver")
+            await start_web_server(application)
+    await loop.run_in_executor(None, cravings.load_numpy)
+    # Полный проход по users занимает поток хранилища — запускаем его последним
+    await start_reminders(application, application.bot_data["store"])
+
+async def post_init(application):
+    """
+    Opens the user store, drains the update backlog when polling and defers
+    the rest of the startup (see ``warm_up``) until the first updates are queued.
+    """
+    store = UserStore(DB_PATH, cache_size=STORE_CACHE_SIZE, flush_interval=STORE_FLUSH_INTERVAL)
+    await store.open()
+    application.bot_data["store"] = store
+
+    polling = BOT_MODE != "webhook" and application.updater is not None
+    METRICS.attach(application, polling=BOT_MODE != "webhook")
+    application.bot_data["loop_monitor"] = asyncio.create_task(METRICS.monitor_event_loop())
+
+    if polling and BACKLOG_DRAIN:
+        await drain_backlog(
+            application,
+            limit=BACKLOG_LIMIT,
+            allowed_updates=ALLOWED_UPDATES,
+            repeatable_texts=REPEATABLE_TEXTS,
+            superseded_prefixes=SUPERSEDED_CALLBACKS,
+            callback_max_age=CALLBACK_MAX_AGE,
+        )
+
+    # Вебхуку сервер нужен до set_webhook, при polling он подождёт первых обновлений
+    if WEB_SERVER_ENABLED and not polling:
+        await start_web_server(application)
+    application.bot_data["warm_up"] = asyncio.create_task(warm_up(application, polling))
+
+async def post_shutdown(application):
+    """
+    Stops the web server, flushes pending writes and closes the user store.
+    """
+    warm_up_task = application.bot_data.pop("warm_up", None)
+    if warm_up_task is not None:
+        warm_up_task.cancel()
+
+    web_server = application.bot_data.pop("web_server", None)
+    if web_server is not None:
+        await web_server.stop()
+
+    loop_monitor = application.bot_data.pop("loop_monitor", None)
+    if loop_monitor is not None:
+        loop_monitor.cancel()
+
+    send_queue = application.bot_data.pop("send_queue", None)
+    if send_queue is not None:
+        await send_queue.stop()
+    application.bot_data.pop("reminders", None)
+
+    store = application.bot_data.pop("store", None)
+    if store is not None:
+        await store.close()
+
+# ---------- РЕЖИМ WEBHOOK ----------
+async def run_webhook(application):
+    """
+    Runs the Application on the current event loop and receives updates via webhook.
+    The web server started in post_init feeds updates into application.update_queue.
+    On shutdown it is stopped first, so every acknowledged update is still processed.
+    """
+    from webserver import web
+    if web is None:
+        raise RuntimeError("Webhook mode requires aiohttp to be installed.")
+    if not WEBHOOK_URL:
+        raise RuntimeError("Webhook mode requires WEBHOOK_URL (or RENDER_EXTERNAL_URL) to be set.")
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.bot.set_webhook(
+            url=f"{WEBHOOK_URL}/{WEBHOOK_SECRET}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=ALLOWED_UPDATES,
+        )
+        await application.start()
+        logger.info("🤖 Bot started in webhook mode on port %s", WEB_PORT)
+        await stop_event.wait()
+    finally:
+        # Обновление, принятое после application.stop(), получило бы 200 без обработки,
+        # а Telegram его не повторит — поэтому сначала перестаём принимать вебхуки
+        web_server = application.bot_data.pop("web_server", None)
+        if web_server is not None:
+            await web_server.stop()
+        if application.running:
+            await application.stop()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        await application.shutdown()
+
+# ---------- СБОРКА ПРИЛОЖЕНИЯ ----------
+def register_handlers(application):
+    """
+    Registers all bot handlers on ``application``.
+    """
+    application.add_handler(CommandHandler("start", instrument(start)))
+    application.add_handler(CommandHandler("stats", instrument(stats_command)))
+    application.add_handler(CommandHandler("reminder", instrument(reminder_command)))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, instrument(handle_message)))
+    application.add_handler(CallbackQueryHandler(instrument(craving_callback)))
+
+def build_request(pool_size=API_POOL_SIZE):
+    """
+    Builds the HTTP client for outgoing Bot API calls.
+    """
+    return BotAPIRequest(
+        connection_pool_size=pool_size,
+        keepalive_expiry=API_KEEPALIVE_EXPIRY,
+        http2=API_HTTP2,
+        method_timeouts=API_TIMEOUTS,
+        pool_timeout=API_POOL_TIMEOUT,
+        connect_timeout=API_CONNECT_TIMEOUT,
+        read_timeout=API_READ_TIMEOUT,
+    )
+
+def build_get_updates_request():
+    """
+    Builds the HTTP client for long polling; it never competes with replies for connections.
+    """
+    # Таймаут чтения getUpdates PTB задаёт сам (timeout long polling + read_timeout)
+    return BotAPIRequest(
+        connection_pool_size=API_POLL_POOL_SIZE,
+        keepalive_expiry=API_KEEPALIVE_EXPIRY,
+        pool_timeout=API_POOL_TIMEOUT,
+        connect_timeout=API_CONNECT_TIMEOUT,
+    )
+
+def build_application(token=BOT_TOKEN, request=None, get_updates_request=None, updater=True):
+    """
+    Builds the Application with all handlers and lifecycle hooks.
+    ``updater=False`` builds an application that only processes updates put
+    into its update_queue (used by shard workers and the benchmark).
+    """
+    builder = (
+        Application.builder()
+        .token(token)
+        .base_url(BOT_API_URL)
+        .request(request or build_request())
+        .concurrent_updates(PerUserUpdateProcessor(UPDATE_CONCURRENCY, UPDATE_MAX_PENDING))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if updater:
+        builder = builder.get_updates_request(get_updates_request or build_get_updates_request())
+    else:
+        builder = builder.updater(None)
+    application = builder.build()
+    register_handlers(application)
+    return application
 
 # ---------- ОСНОВНАЯ ФУНКЦИЯ ----------
 def main():
     """
     Main entry point for initializing and running the Telegram bot and web server.
     """
+    setup_logging()
     logger.info("Starting bot initialization...")
     
     try:
+        from sharding import rebalance_shards, run_sharded
+        # Пользователи должны лежать в файле своего шарда (или в основной базе при SHARDS=1)
+        rebalance_shards(DB_PATH, SHARDS)
+        if SHARDS > 1:
+            run_sharded(SHARDS)
+            return
+
         # Создаем приложение
-        application = Application.builder().token(BOT_TOKEN).build()
+        application = build_application()
         
-        # Добавляем обработчики
-        application.add_handler(CommandHandler("start", start))
-        application.add_handler(CommandHandler("stats", stats_command))
-        application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-        application.add_handler(CallbackQueryHandler(craving_callback))
-        
-        # Запускаем веб-сервер в отдельном потоке
-        web_thread = Thread(target=run_web_server)
-        web_thread.daemon = True
-        web_thread.start()
-        
-        # Запускаем бота
-        logger.info(f"🤖 Bot started успешно on port {WEB_PORT}")
-        logger.info("🌐 Web server is running")
+        if BOT_MODE == "webhook":
+            asyncio.run(run_webhook(application))
+            return
+
+        # Запускаем бота (веб-сервер поднимается в post_init на том же event loop)
+        logger.info("🤖 Bot started успешно on port %s", WEB_PORT)
         # Явно разрешаем получать и обрабатывать callback_query (нажатия inline-кнопок)
-        application.run_polling(allowed_updates=["message", "callback_query"])
-        
+        application.run_polling(allowed_updates=ALLOWED_UPDATES)
+
     except Exception as e:
-        logger.error(f"Failed to start bot: {e}")
+        logger.error("Failed to start bot: %s", e)
         raise
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
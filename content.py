@@ -0,0 +1,212 @@
+"""
+Content catalog: button labels, reply texts, coping methods and keyboards.
+
+Everything here is built once at import time. Keyboards are immutable
+Telegram objects and are additionally serialized to JSON once, so handlers
+can reuse the same payload instead of re-serializing markup on every reply.
+Adding a menu item or coping method is a data change in this module.
+"""
+import json
+
+from telegram import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
+
+# ---------- КНОПКИ ----------
+BTN_START_JOURNEY = "В путь в трезвую жизнь"
+BTN_CRAVING = "Тяга сейчас"
+BTN_STATS = "Моя статистика"
+BTN_RELAPSE = "Сорвался(ась)"
+BTN_SETTINGS = "Настройки"
+
+# Префиксы callback_data; аргумент после последнего "_" не должен содержать "_"
+CB_CRAVING_SCALE = "craving_scale"
+CB_CRAVING_METHOD = "craving_method"
+
+CRAVING_LEVELS = range(0, 11)
+
+# ---------- ТЕКСТЫ ----------
+TEXTS = {
+    "welcome": (
+        "Привет! Я бот, который помогает работать с алкогольной тягой.\n\n"
+        "⚠️ Я не врач и не заменяю лечение.\n"
+        f"Нажми «{BTN_START_JOURNEY}», чтобы начать."
+    ),
+    "journey_started": (
+        "Отлично! Трекер трезвости запущен. 🎉\n\n"
+        "Теперь ты можешь:\n"
+        "• Отслеживать дни трезвости\n"
+        "• Получать помощь при тяге\n"
+        "• Видеть свою статистику\n\n"
+        "Используй кнопки ниже:"
+    ),
+    "stats_not_started": (
+        "Трекер трезвости пока не запущен.\n\n"
+        f"Нажми «{BTN_START_JOURNEY}», чтобы начать отсчёт."
+    ),
+    "stats": (
+        "\n"
+        "🎉 ТРЕЗВОСТЬ: {days} {days_word}\n\n"
+        "💰 Сэкономлено денег: {money_saved} руб\n"
+        "⏰ Сэкономлено времени: {hours_saved} {hours_word}\n"
+        "📈 Улучшение здоровья: +{health_percent}%\n\n"
+        "Ты делаешь огромные шаги! 💪\n"
+    ),
+    "craving_prompt": (
+        "🆘 ПОМОЩЬ ПРИ ТЯГЕ\n\n"
+        "Оцени, пожалуйста, силу тяги по шкале от 0 до 10.\n"
+        "0 — совсем не тянет, 10 — очень сильное желание выпить.\n\n"
+        "Нажми на одну из кнопок ниже:"
+    ),
+    "craving_level_low": (
+        "Ты отметил(а) тягу на уровне {level}/10.\n\n"
+        "Тяга сейчас слабая — это хороший знак. Всё равно важно позаботиться о себе.\n"
+        "Выбери ниже способ, который хочешь попробовать:"
+    ),
+    "craving_level_mid": (
+        "Ты отметил(а) тягу на уровне {level}/10.\n\n"
+        "Тяга уже ощутимая. Давай выберем одно из упражнений, чтобы её снизить.\n"
+        "Выбери способ ниже:"
+    ),
+    "craving_level_high": (
+        "Ты отметил(а) очень сильную тягу: {level}/10.\n\n"
+        "Это тяжело, но это состояние пройдет. Сейчас важно сделать хотя бы один маленький шаг.\n"
+        "Выбери способ, который готов(а) попробовать прямо сейчас:"
+    ),
+    "method_unknown": "Выбери один из доступных способов борьбы с тягой ниже.",
+    "relapse": (
+        "Не осуждаю тебя 🙏\n"
+        "Это не конец, а опыт. Ты справишься.\n\n"
+        f"Нажми «{BTN_START_JOURNEY}», чтобы начать заново."
+    ),
+    "settings": (
+        "Настройки:\n"
+        "• Трекер трезвости: {tracker}\n"
+        "• Ежедневные уведомления: {reminders}\n"
+        "• Статистика: собирается\n\n"
+        "Изменить время уведомлений: /reminder ЧЧ:ММ\n"
+        "Выключить: /reminder off, включить: /reminder on"
+    ),
+    "reminder_usage": "Используй: /reminder ЧЧ:ММ, /reminder on или /reminder off",
+    "reminder_updated": "Готово! Ежедневные уведомления: {reminders}",
+    "reminder": (
+        "☀️ Напоминание\n\n"
+        "Ты держишься уже {days} {days_word}. Так держать!\n"
+        "Если появится тяга — нажми «{btn_craving}»."
+    ),
+    "reminder_not_started": (
+        "☀️ Напоминание\n\n"
+        "Каждый день — новая возможность. "
+        "Нажми «{btn_start}», когда будешь готов(а) начать."
+    ),
+    "stats_cravings_header": "\n🧠 Тяга (всего отмечено: {total}, в среднем {average:.1f}/10, пик {peak}/10)\n",
+    "stats_cravings_window": "• За {days} дней: {count} {times_word}, в среднем {average:.1f}/10, пик {peak}/10{trend}\n",
+    "stats_cravings_trend_down": " ↓ на {delta:.1f}",
+    "stats_cravings_trend_up": " ↑ на {delta:.1f}",
+    "stats_cravings_hour": "• Чаще всего тянет около {hour:02d}:00\n",
+    "stats_cravings_best_method": "• Лучше всего помогает: {method}\n",
+    "fallback": "Используй кнопки меню 👇",
+}
+
+# ---------- СПОСОБЫ СПРАВИТЬСЯ С ТЯГОЙ ----------
+# (ключ, подпись кнопки, текст-описание); порядок = порядок кнопок
+COPING_METHODS = [
+    (
+        "breath",
+        "Дыхание",
+        "🧘 Упражнение «Дыхание 4–7–8»\n\n"
+        "1. Вдохни через нос на 4 счёта.\n"
+        "2. Задержи дыхание на 7 счётов.\n"
+        "3. Медленно выдыхай через рот на 8 счётов.\n\n"
+        "Сделай так 4 цикла. Это помогает снизить напряжение и сигнализирует мозгу, что опасности нет.",
+    ),
+    (
+        "water",
+        "Стакан воды",
+        "💧 Стакан воды\n\n"
+        "Налей стакан холодной воды и выпей его небольшими глотками.\n"
+        "Сосредоточься на ощущениях: как вода проходит по горлу, какая она на вкус, какая температура.\n\n"
+        "Это переключает внимание и помогает телу почувствовать себя лучше.",
+    ),
+    (
+        "move",
+        "Движение/упражнение",
+        "🏃 Движение/упражнение\n\n"
+        "Выбери любое простое движение: приседания, отжимания, быстрая ходьба по комнате, растяжка.\n"
+        "Сделай 10–20 повторений или 3–5 минут движения.\n\n"
+        "Тело сбрасывает напряжение, и тяга часто уменьшается.",
+    ),
+    (
+        "call",
+        "Позвонить другу",
+        "📞 Позвонить другу\n\n"
+        "Позвони человеку, который может поддержать. Скажи честно, что тебе сейчас тяжело.\n"
+        "Даже 5 минут разговора могут сильно снизить тягу.\n\n"
+        "Если нет подходящего человека — можно написать сообщение самому себе или в дневник.",
+    ),
+    (
+        "focus",
+        "Переключить внимание",
+        "🎯 Переключить внимание\n\n"
+        "Выбери занятие, которое может увлечь: сериал, игра, книга, музыка, уборка, душ.\n"
+        "Поставь таймер на 15–20 минут и полностью уйди в это занятие.\n\n"
+        "Обычно к концу этого времени волна тяги заметно снижается.",
+    ),
+]
+
+METHOD_TEXTS = {key: text for key, _label, text in COPING_METHODS}
+# Коды способов хранятся в истории тяги (0 — способ не выбран), поэтому новые
+# способы добавляются только в конец списка
+METHOD_CODES = {key: code for code, (key, _label, _text) in enumerate(COPING_METHODS, start=1)}
+METHOD_LABELS = {code: label for code, (_key, label, _text) in enumerate(COPING_METHODS, start=1)}
+
+
+def _craving_level_text(level):
+    if level <= 3:
+        return TEXTS["craving_level_low"].format(level=level)
+    if level <= 7:
+        return TEXTS["craving_level_mid"].format(level=level)
+    return TEXTS["craving_level_high"].format(level=level)
+
+
+CRAVING_LEVEL_TEXTS = {level: _craving_level_text(level) for level in CRAVING_LEVELS}
+
+
+def callback_data(prefix, arg):
+    """
+    Builds callback data in the ``<prefix>_<arg>`` format parsed by the router.
+    """
+    return f"{prefix}_{arg}"
+
+
+# ---------- КЛАВИАТУРЫ ----------
+def _build_keyboards():
+    levels = [
+        InlineKeyboardButton(str(level), callback_data=callback_data(CB_CRAVING_SCALE, level))
+        for level in CRAVING_LEVELS
+    ]
+    return {
+        "main": ReplyKeyboardMarkup(
+            keyboard=[
+                [KeyboardButton(text=BTN_CRAVING), KeyboardButton(text=BTN_STATS)],
+                [KeyboardButton(text=BTN_RELAPSE), KeyboardButton(text=BTN_SETTINGS)],
+            ],
+            resize_keyboard=True,
+        ),
+        "intro": ReplyKeyboardMarkup(
+            keyboard=[[KeyboardButton(text=BTN_START_JOURNEY)]],
+            resize_keyboard=True,
+        ),
+        "craving_scale": InlineKeyboardMarkup([levels[:6], levels[6:]]),
+        "craving_methods": InlineKeyboardMarkup([
+            [InlineKeyboardButton(label, callback_data=callback_data(CB_CRAVING_METHOD, key))]
+            for key, label, _text in COPING_METHODS
+        ]),
+    }
+
+
+KEYBOARDS = _build_keyboards()
+
+# Готовый JSON для параметра reply_markup: PTB передаёт строки в запрос как есть
+KEYBOARD_JSON = {
+    name: json.dumps(markup.to_dict(), ensure_ascii=False, separators=(",", ":"))
+    for name, markup in KEYBOARDS.items()
+}
@@ -0,0 +1,208 @@
+"""
+Compact per-user craving time series and vectorized analytics.
+
+Each event is a fixed 6-byte record (uint32 timestamp, uint8 level, uint8
+method code) appended to a bytearray, so a user's history is a single
+buffer rather than a list of Python objects or table rows. Analytics view
+the buffer as a NumPy structured array without copying; when NumPy is not
+installed the same results are computed with plain Python. NumPy is
+imported on first use (or by ``load_numpy``) to keep it off the startup path.
+"""
+import struct
+import time
+
+np = None
+DTYPE = None
+_numpy_loaded = False
+
+RECORD = struct.Struct("<IBB")
+RECORD_SIZE = RECORD.size
+SECONDS_PER_DAY = 86400
+# Выбор способа относится к последней оценке, если сделан не позже чем через 30 минут
+METHOD_WINDOW = 30 * 60
+NO_METHOD = 0
+
+
+def load_numpy():
+    """
+    Imports NumPy once; returns the module, or None when it is not installed.
+    """
+    global np, DTYPE, _numpy_loaded
+    if not _numpy_loaded:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        if numpy is not None:
+            DTYPE = numpy.dtype([("ts", "<u4"), ("level", "u1"), ("method", "u1")])
+        np = numpy
+        _numpy_loaded = True
+    return np
+
+
+# ---------- РЯД СОБЫТИЙ ----------
+class CravingSeries:
+    """
+    Append-only craving events of one user: (timestamp, level, method code).
+    """
+
+    __slots__ = ("data",)
+
+    def __init__(self, data=b""):
+        if len(data) % RECORD_SIZE:
+            raise ValueError("Craving series data is truncated")
+        self.data = bytearray(data)
+
+    def __len__(self):
+        return len(self.data) // RECORD_SIZE
+
+    def append(self, level, ts=None):
+        ts = int(time.time() if ts is None else ts)
+        self.data += RECORD.pack(ts, level, NO_METHOD)
+
+    def set_method(self, method_code, ts=None):
+        """
+        Attaches a coping method to the latest event if it has none yet and
+        is recent enough. Returns True if the event was updated.
+        """
+        if not self.data:
+            return False
+        ts = int(time.time() if ts is None else ts)
+        last_ts, _level, method = RECORD.unpack_from(self.data, len(self.data) - RECORD_SIZE)
+        if method != NO_METHOD or ts - last_ts > METHOD_WINDOW:
+            return False
+        self.data[-1] = method_code
+        return True
+
+    def columns(self):
+        """
+        Returns (timestamps, levels, methods) as NumPy arrays (zero-copy) or lists.
+        """
+        if load_numpy() is not None:
+            events = np.frombuffer(self.data, dtype=DTYPE)
+            return events["ts"], events["level"], events["method"]
+        if not self.data:
+            return [], [], []
+        ts, levels, methods = zip(*RECORD.iter_unpack(bytes(self.data)))
+        return list(ts), list(levels), list(methods)
+
+
+# ---------- АНАЛИТИКА ----------
+def _window(ts, levels, start, end):
+    if np is not None:
+        mask = (ts >= start) & (ts < end)
+        selected = levels[mask]
+        if not selected.size:
+            return 0, None, None
+        return int(selected.size), float(selected.mean()), int(selected.max())
+    selected = [level for t, level in zip(ts, levels) if start <= t < end]
+    if not selected:
+        return 0, None, None
+    return len(selected), sum(selected) / len(selected), max(selected)
+
+
+def _window_report(ts, levels, now, days):
+    start = now - days * SECONDS_PER_DAY
+    count, average, peak = _window(ts, levels, start, now + 1)
+    _prev_count, prev_average, _prev_peak = _window(ts, levels, start - days * SECONDS_PER_DAY, start)
+    trend = None
+    if average is not None and prev_average is not None:
+        trend = average - prev_average
+    return {"count": count, "average": average, "peak": peak, "trend": trend}
+
+
+def _hour_heatmap(ts, tz_offset):
+    offset = tz_offset * 60
+    if np is not None:
+        hours = ((ts.astype(np.int64) + offset) % SECONDS_PER_DAY) // 3600
+        return np.bincount(hours, minlength=24).tolist()
+    heatmap = [0] * 24
+    for t in ts:
+        heatmap[(t + offset) % SECONDS_PER_DAY // 3600] += 1
+    return heatmap
+
+
+def _method_effect(levels, methods):
+    """
+    For each method code: (times the next rating was lower, times it was used
+    before another rating).
+    """
+    if np is not None:
+        if levels.size < 2:
+            return {}
+        used = methods[:-1]
+        improved = levels[1:] < levels[:-1]
+        mask = used != NO_METHOD
+        totals = np.bincount(used[mask], minlength=256)
+        wins = np.bincount(used[mask & improved], minlength=256)
+        return {int(code): (int(wins[code]), int(totals[code])) for code in np.flatnonzero(totals)}
+    effect = {}
+    for method, level, next_level in zip(methods, levels, levels[1:]):
+        if method == NO_METHOD:
+            continue
+        wins, total = effect.get(method, (0, 0))
+        effect[method] = (wins + (next_level < level), total + 1)
+    return effect
+
+
+def _best_method(effect):
+    if not effect:
+        return None
+    code, (wins, total) = max(effect.items(), key=lambda item: (item[1][0], item[1][0] / item[1][1]))
+    return code if wins else None
+
+
+def _report(ts, levels, methods, now, tz_offset):
+    total = len(levels)
+    effect = _method_effect(levels, methods)
+    if not total:
+        average = peak = None
+    elif np is not None:
+        average, peak = float(levels.mean()), int(levels.max())
+    else:
+        average, peak = sum(levels) / total, max(levels)
+    return {
+        "total": total,
+        "average": average,
+        "peak": peak,
+        "last_7_days": _window_report(ts, levels, now, 7),
+        "last_30_days": _window_report(ts, levels, now, 30),
+        "heatmap": _hour_heatmap(ts, tz_offset),
+        "method_effect": effect,
+        "best_method": _best_method(effect),
+    }
+
+
+def analyze(series, now=None, tz_offset=0):
+    """
+    Computes the stats-screen report for one user's series.
+    """
+    now = int(time.time() if now is None else now)
+    ts, levels, methods = series.columns()
+    return _report(ts, levels, methods, now, tz_offset)
+
+
+def cohort_report(blobs, now=None, tz_offset=0):
+    """
+    Computes the same report over many users' raw series buffers at once.
+    Cross-user pairs are excluded from the method effect.
+    """
+    now = int(time.time() if now is None else now)
+    blobs = [blob for blob in blobs if blob]
+    if load_numpy() is not None:
+        events = np.frombuffer(b"".join(blobs), dtype=DTYPE)
+        methods = events["method"].copy()
+        if blobs:
+            # Последнее событие пользователя не должно «предшествовать» первому событию следующего
+            ends = np.cumsum([len(blob) // RECORD_SIZE for blob in blobs]) - 1
+            methods[ends] = NO_METHOD
+        return _report(events["ts"], events["level"], methods, now, tz_offset)
+
+    ts, levels, methods = [], [], []
+    for blob in blobs:
+        series_ts, series_levels, series_methods = CravingSeries(blob).columns()
+        series_methods[-1] = NO_METHOD
+        ts += series_ts
+        levels += series_levels
+        methods += series_methods
+    return _report(ts, levels, methods, now, tz_offset)
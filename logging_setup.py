@@ -0,0 +1,186 @@
+"""
+Non-blocking logging pipeline.
+
+Records are filtered and sampled on the calling side, then handed to a
+background thread through a queue; message formatting and stream writes
+happen on that thread, never on the event loop. Configuration comes from
+the environment:
+
+    LOG_LEVEL           root level (default INFO)
+    LOG_LEVELS          per-logger levels, e.g. "httpx=WARNING,bot=DEBUG"
+    LOG_SAMPLE          fraction of sub-WARNING records kept, per logger or
+                        handler, e.g. "bot=0.1,craving_callback=0.5"
+    LOG_DEBUG_USERS     user ids whose records are always kept, at any level
+    LOG_DEBUG_HANDLERS  handler names whose records are always kept
+    LOG_FORMAT          "json" (default) or "text"
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+
+current_user = contextvars.ContextVar("current_user", default=None)
+current_handler = contextvars.ContextVar("current_handler", default=None)
+
+# Наши логгеры; при точечной отладке им разрешается DEBUG, а лишнее режет фильтр
+APP_LOGGERS = ("bot", "__main__", "storage", "reminders", "webserver", "backlog", "transport", "responses")
+DEFAULT_LEVELS = {"httpx": logging.WARNING, "apscheduler": logging.WARNING}
+STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+def _parse_mapping(value):
+    result = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        key, _, val = item.partition("=")
+        result[key.strip()] = val.strip()
+    return result
+
+
+def _parse_level(value):
+    return value if isinstance(value, int) else logging.getLevelName(value.upper())
+
+
+# ---------- ФИЛЬТР ----------
+class ContextFilter(logging.Filter):
+    """
+    Attaches user id and handler name from the current context to every record,
+    then applies per-logger levels, sampling and the debug overrides.
+    """
+
+    def __init__(self, root_level, levels, sample, debug_users, debug_handlers):
+        super().__init__()
+        self.root_level = root_level
+        self.levels = levels
+        self.sample = sample
+        self.debug_users = debug_users
+        self.debug_handlers = debug_handlers
+        self._thresholds = {}
+
+    def _lookup(self, mapping, name, default):
+        # "a.b.c" -> "a.b.c", "a.b", "a"
+        while name:
+            if name in mapping:
+                return mapping[name]
+            name = name.rpartition(".")[0]
+        return default
+
+    def threshold(self, name):
+        level = self._thresholds.get(name)
+        if level is None:
+            level = self._thresholds[name] = self._lookup(self.levels, name, self.root_level)
+        return level
+
+    def filter(self, record):
+        if not hasattr(record, "user_id"):
+            record.user_id = current_user.get()
+        if not hasattr(record, "handler"):
+            record.handler = current_handler.get()
+
+        if record.user_id in self.debug_users or record.handler in self.debug_handlers:
+            return True
+        if record.levelno < self.threshold(record.name):
+            return False
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.sample.get(record.handler)
+        if rate is None:
+            rate = self._lookup(self.sample, record.name, 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+
+# ---------- ФОРМАТИРОВАНИЕ ----------
+class JsonFormatter(logging.Formatter):
+    """
+    Renders a record as one JSON object per line, including any ``extra`` fields.
+    """
+
+    def format(self, record):
+        data = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in STANDARD_ATTRS and value is not None:
+                data[key] = value
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that does not format on the calling thread.
+    The stock ``prepare`` renders the message eagerly; here formatting is left
+    to the listener thread. Log arguments therefore must not be mutated after
+    the call, which holds for the ids, strings and numbers logged in this bot.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+# ---------- НАСТРОЙКА ----------
+def setup_logging(env=None):
+    """
+    Installs the queue-based pipeline on the root logger and returns the listener.
+    """
+    env = os.environ if env is None else env
+    root_level = _parse_level(env.get("LOG_LEVEL", "INFO"))
+    levels = dict(DEFAULT_LEVELS)
+    levels.update({name: _parse_level(level) for name, level in _parse_mapping(env.get("LOG_LEVELS", "")).items()})
+    sample = {name: float(rate) for name, rate in _parse_mapping(env.get("LOG_SAMPLE", "")).items()}
+    debug_users = {int(uid) for uid in env.get("LOG_DEBUG_USERS", "").split(",") if uid.strip()}
+    debug_handlers = {name.strip() for name in env.get("LOG_DEBUG_HANDLERS", "").split(",") if name.strip()}
+
+    stream = logging.StreamHandler(sys.stdout)
+    if env.get("LOG_FORMAT", "json").lower() == "json":
+        stream.setFormatter(JsonFormatter())
+    else:
+        stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter(root_level, levels, sample, debug_users, debug_handlers))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+
+    # Уровни логгеров отсекают записи ещё до создания LogRecord
+    root.setLevel(root_level)
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level)
+    if debug_users or debug_handlers:
+        for name in APP_LOGGERS:
+            logging.getLogger(name).setLevel(logging.DEBUG)
+
+    listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+def log_context(handler_name, user_id):
+    """
+    Sets the handler/user context for log records; returns tokens for ``reset_context``.
+    """
+    return current_handler.set(handler_name), current_user.set(user_id)
+
+
+def reset_context(tokens):
+    handler_token, user_token = tokens
+    current_handler.reset(handler_token)
+    current_user.reset(user_token)
+
+
+def elapsed_ms(started):
+    return round((time.perf_counter() - started) * 1000, 2)
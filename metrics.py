@@ -0,0 +1,357 @@
+"""
+In-process metrics with Prometheus text exposition and a readiness check.
+
+The module-level ``METRICS`` instance is updated by the handler wrapper,
+the instrumented Bot API request class and the event-loop monitor, and is
+rendered by the web server on ``/metrics``.
+"""
+import asyncio
+import bisect
+import logging
+import os
+import time
+
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Ожидание соединения из пула обычно почти нулевое, поэтому нужны более мелкие корзины
+POOL_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+# Вызовы, которыми бот отвечает пользователю
+REPLY_METHODS = frozenset({"sendMessage", "editMessageText", "answerCallbackQuery"})
+
+
+def process_start_time():
+    """
+    Wall-clock time the current process started (Linux), else the current time.
+    """
+    try:
+        with open("/proc/self/stat") as stat:
+            # Поля после имени процесса; starttime — 22-е поле, в тиках с момента загрузки
+            ticks = int(stat.read().rpartition(")")[2].split()[19])
+        with open("/proc/uptime") as uptime:
+            since_boot = float(uptime.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return time.time()
+    return time.time() - (since_boot - ticks / os.sysconf("SC_CLK_TCK"))
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _add_label(labels, name, value):
+    pair = f'{name}="{value}"'
+    return "{" + pair + ("," + labels[1:] if labels else "}")
+
+
+# ---------- ТИПЫ МЕТРИК ----------
+class Counter:
+    """
+    Monotonic counter, optionally split by labels.
+    """
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def samples(self):
+        for label_values, value in self._values.items():
+            yield self.name, _labels(self.labels, label_values), value
+
+
+class Gauge:
+    """
+    Gauge that is either set explicitly (optionally per label set) or read
+    from ``func`` at scrape time.
+    """
+    kind = "gauge"
+
+    def __init__(self, name, help_text, func=None, labels=()):
+        self.name = name
+        self.help = help_text
+        self.func = func
+        self.labels = labels
+        self._values = {(): 0}
+
+    def set(self, value, *label_values):
+        self._values[label_values] = value
+
+    def value(self, *label_values):
+        return self.func() if self.func is not None else self._values.get(label_values, 0)
+
+    def samples(self):
+        if self.func is not None:
+            yield self.name, "", self.func()
+            return
+        for label_values, value in self._values.items():
+            if len(label_values) == len(self.labels):
+                yield self.name, _labels(self.labels, label_values), value
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram, optionally split by labels.
+    """
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series = {}
+
+    def observe(self, value, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            # [счётчики по корзинам..., +Inf, сумма]
+            series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def count(self, *label_values):
+        series = self._series.get(label_values)
+        return sum(series[:-1]) if series else 0
+
+    def samples(self):
+        for label_values, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                labels = _labels(self.labels + ("le",), label_values + (bound,))
+                yield f"{self.name}_bucket", labels, cumulative
+            labels = _labels(self.labels, label_values)
+            yield f"{self.name}_sum", labels, series[-1]
+            yield f"{self.name}_count", labels, cumulative
+
+
+# ---------- НАБОР МЕТРИК БОТА ----------
+class Metrics:
+    """
+    All metrics exported by the bot plus the state used by the readiness check.
+    """
+
+    def __init__(self, active_window=300):
+        self.active_window = active_window
+        self.started = time.time()
+        self.process_started = process_start_time()
+        self.first_reply = None
+        self.application = None
+        self.polling = True
+        self.last_fetch = None
+        # Устанавливается после первого успешного getUpdates
+        self.fetched = asyncio.Event()
+        self.last_processed = None
+        self.handler_observers = []
+        self.remote = {}
+        self._active = {}
+        self._active_prune_at = 1024
+
+        self.handler_latency = Histogram(
+            "bot_handler_latency_seconds", "Handler latency.", labels=("handler",))
+        self.handler_errors = Counter(
+            "bot_handler_errors_total", "Exceptions raised by handlers.", labels=("handler",))
+        self.api_latency = Histogram(
+            "bot_api_request_latency_seconds", "Bot API call latency.", labels=("method",))
+        self.api_errors = Counter(
+            "bot_api_errors_total", "Failed Bot API calls by kind (error, retry_after).",
+            labels=("method", "kind"))
+        self.api_pool_wait = Histogram(
+            "bot_api_pool_wait_seconds", "Time a Bot API call waited for a pooled connection.",
+            labels=("method",), buckets=POOL_BUCKETS)
+        self.api_connect = Histogram(
+            "bot_api_connect_seconds", "Time spent opening new connections (TCP and TLS).", labels=("method",))
+        self.api_wire = Histogram(
+            "bot_api_wire_seconds", "Time from sending a Bot API request to the end of its response.",
+            labels=("method",))
+        self.update_queue_depth = Gauge(
+            "bot_update_queue_depth", "Updates queued or waiting in the update processor.", self._queue_depth)
+        self.event_loop_lag = Gauge(
+            "bot_event_loop_lag_seconds", "Most recent event-loop scheduling delay.")
+        self.active_users = Gauge(
+            "bot_active_users", f"Users seen during the last {active_window} seconds.", self._active_count)
+        self.send_queue_backlog = Gauge(
+            "bot_send_queue_backlog", "Broadcast messages waiting to be sent.", self._send_backlog)
+        self.time_to_first_reply = Gauge(
+            "bot_time_to_first_reply_seconds", "Time from process start to the first successful reply.")
+        self.all = [
+            self.handler_latency, self.handler_errors, self.api_latency, self.api_errors,
+            self.api_pool_wait, self.api_connect, self.api_wire,
+            self.update_queue_depth, self.event_loop_lag, self.active_users, self.send_queue_backlog,
+            self.time_to_first_reply,
+        ]
+
+    def register(self, metric):
+        """
+        Adds an extra metric to the exported set and returns it.
+        """
+        self.all.append(metric)
+        return metric
+
+    def attach(self, application, polling=True):
+        self.application = application
+        self.polling = polling
+
+    # --- сбор ---
+    def observe_handler(self, handler, seconds, user_id=None, failed=False):
+        self.handler_latency.observe(seconds, handler)
+        if failed:
+            self.handler_errors.inc(handler)
+        now = time.time()
+        self.last_processed = now
+        if user_id is not None:
+            self._active[user_id] = now
+            # Без опроса /metrics словарь тоже не должен расти бесконечно: чистим при удвоении
+            if len(self._active) >= self._active_prune_at:
+                self._prune_active(now)
+        for observer in self.handler_observers:
+            observer(handler, seconds)
+
+    def observe_api(self, method, seconds, status=None, failed=False):
+        self.api_latency.observe(seconds, method)
+        if status == 429:
+            self.api_errors.inc(method, "retry_after")
+        elif failed or (status is not None and status >= 400):
+            self.api_errors.inc(method, "error")
+        elif method == "getUpdates":
+            self.last_fetch = time.time()
+            self.fetched.set()
+        elif method in REPLY_METHODS and self.first_reply is None:
+            self.first_reply = time.time() - self.process_started
+            self.time_to_first_reply.set(self.first_reply)
+            logger.info("First reply sent %.3f s after process start", self.first_reply)
+
+    def observe_api_phases(self, method, pool_wait, connect, wire):
+        """
+        Records where a Bot API call spent its time; ``connect`` is None when
+        a kept-alive connection was reused.
+        """
+        self.api_pool_wait.observe(pool_wait, method)
+        if connect is not None:
+            self.api_connect.observe(connect, method)
+        self.api_wire.observe(wire, method)
+
+    def _queue_depth(self):
+        if self.application is None:
+            return 0
+        # При конкурентной обработке обновления сразу уходят из очереди в процессор
+        waiting = getattr(self.application.update_processor, "pending", 0)
+        return self.application.update_queue.qsize() + waiting
+
+    def _send_backlog(self):
+        send_queue = self.application.bot_data.get("send_queue") if self.application is not None else None
+        return send_queue.backlog if send_queue is not None else 0
+
+    def _prune_active(self, now):
+        cutoff = now - self.active_window
+        self._active = {user_id: seen for user_id, seen in self._active.items() if seen >= cutoff}
+        self._active_prune_at = max(1024, 2 * len(self._active))
+
+    def _active_count(self):
+        self._prune_active(time.time())
+        return len(self._active)
+
+    # --- экспорт ---
+    def snapshot(self):
+        """
+        Returns every metric as ``(name, kind, help, samples)`` tuples that can
+        be sent to another process and passed to ``set_remote`` there.
+        """
+        return [(metric.name, metric.kind, metric.help, list(metric.samples())) for metric in self.all]
+
+    def set_remote(self, source, snapshot):
+        """
+        Stores the latest ``snapshot`` of another process; ``render`` exports
+        its samples with a ``shard="<source>"`` label.
+        """
+        self.remote[source] = snapshot
+
+    def render(self):
+        """
+        Renders all metrics in the Prometheus text exposition format.
+        """
+        families = {}
+        for metric in self.all:
+            families[metric.name] = (metric.kind, metric.help, list(metric.samples()))
+        for source, snapshot in sorted(self.remote.items()):
+            for metric_name, kind, help_text, samples in snapshot:
+                family = families.setdefault(metric_name, (kind, help_text, []))
+                family[2].extend((name, _add_label(labels, "shard", source), value) for name, labels, value in samples)
+        lines = []
+        for metric_name, (kind, help_text, samples) in families.items():
+            lines.append(f"# HELP {metric_name} {help_text}")
+            lines.append(f"# TYPE {metric_name} {kind}")
+            for name, labels, value in samples:
+                lines.append(f"{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+    def readiness(self, fetch_stall=90.0, process_stall=30.0, max_loop_lag=1.0):
+        """
+        Returns ``(ready, reasons)``. Not ready when the application is not
+        running, polling has not fetched updates recently, queued updates are
+        not being processed, or the event loop is lagging.
+        """
+        now = time.time()
+        reasons = []
+        if self.application is None or not self.application.running:
+            reasons.append("application is not running")
+        if self.polling:
+            last_fetch = self.last_fetch or self.started
+            if now - last_fetch > fetch_stall:
+                reasons.append(f"no successful getUpdates for {now - last_fetch:.0f}s")
+        if self._queue_depth() > 0:
+            last_processed = self.last_processed or self.started
+            if now - last_processed > process_stall:
+                reasons.append(f"update queue stalled for {now - last_processed:.0f}s")
+        if self.event_loop_lag.value() > max_loop_lag:
+            reasons.append(f"event loop lag {self.event_loop_lag.value():.2f}s")
+        return not reasons, reasons
+
+    async def monitor_event_loop(self, interval=0.5):
+        """
+        Measures how late the event loop wakes up from a fixed sleep.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(interval)
+            self.event_loop_lag.set(max(0.0, loop.time() - started - interval))
+
+
+METRICS = Metrics()
+
+
+# ---------- ИНСТРУМЕНТИРОВАННЫЙ HTTP-КЛИЕНТ ----------
+class InstrumentedRequest(HTTPXRequest):
+    """
+    HTTPXRequest that records latency, errors and 429s per Bot API method.
+    """
+
+    def __init__(self, *args, metrics=METRICS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = metrics
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        api_method = url.rpartition("/")[2]
+        started = time.perf_counter()
+        try:
+            status, payload = await super().do_request(url, method, request_data, **kwargs)
+        except Exception:
+            self.metrics.observe_api(api_method, time.perf_counter() - started, failed=True)
+            raise
+        self.metrics.observe_api(api_method, time.perf_counter() - started, status=status)
+        return status, payload
@@ -0,0 +1,340 @@
+"""
+Daily reminders: a heap-based scheduler and a rate-limited send queue.
+
+The scheduler keeps one heap entry per user keyed by the next due UTC
+timestamp, so a single repeating job only pops the users that are due.
+Messages go through SendQueue, which respects Telegram's global and
+per-chat limits and backs off on RetryAfter. A user's next reminder is
+scheduled only once the current one has been sent, and the time of the
+last delivered reminder is stored, so reminders that were queued but not
+sent before a restart, or that fell due while the bot was down, are
+delivered on startup if their local day has not ended yet.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+from telegram.error import Forbidden, RetryAfter, TelegramError
+
+logger = logging.getLogger(__name__)
+
+SECONDS_PER_DAY = 86400
+
+
+def next_due(reminder_time, tz_offset, now=None, last_sent=None):
+    """
+    Returns the next UTC timestamp at which a reminder set for ``reminder_time``
+    (minutes after local midnight) in ``tz_offset`` (minutes from UTC) is due.
+
+    If ``last_sent`` is given and today's reminder has already passed but was
+    sent earlier than it was due, today's (overdue) timestamp is returned.
+    """
+    now = time.time() if now is None else now
+    offset = tz_offset * 60
+    local_now = now + offset
+    due_local = local_now - local_now % SECONDS_PER_DAY + reminder_time * 60
+    if due_local <= local_now and (last_sent is None or last_sent >= due_local - offset):
+        due_local += SECONDS_PER_DAY
+    return due_local - offset
+
+
+# ---------- ОЧЕРЕДЬ ОТПРАВКИ ----------
+class TokenBucket:
+    """
+    Async token bucket allowing ``rate`` acquisitions per second with bursts of ``capacity``.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class SendQueue:
+    """
+    Outgoing message queue for broadcasts.
+
+    Each message gets a ready time no earlier than ``per_chat_interval`` after
+    the previous message to the same chat; workers take messages in ready-time
+    order and draw from a global token bucket. On RetryAfter all workers pause
+    for the requested time and the message is retried. ``on_sent`` and
+    ``on_failed`` are awaited with the chat id once a message is delivered or
+    given up on; ``on_forbidden`` runs before ``on_failed`` when the user
+    blocked the bot.
+
+    A message put without text is rendered right before sending by awaiting
+    ``render(chat_id)``; it is dropped when that returns None.
+    """
+
+    def __init__(self, bot, global_rate=30, per_chat_interval=1.0, workers=8,
+                 on_forbidden=None, on_sent=None, on_failed=None, render=None):
+        self.bot = bot
+        self.per_chat_interval = per_chat_interval
+        self.workers = workers
+        self.render = render
+        self.on_forbidden = on_forbidden
+        self.on_sent = on_sent
+        self.on_failed = on_failed
+        self._bucket = TokenBucket(global_rate)
+        self._heap = []
+        self._seq = itertools.count()
+        self._chat_ready = {}
+        self._paused_until = 0.0
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+
+    @property
+    def backlog(self):
+        """
+        Number of messages waiting to be sent.
+        """
+        return len(self._heap)
+
+    def stats(self):
+        return {"backlog": self.backlog, "sent": self.sent, "failed": self.failed, "retried": self.retried}
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._heap:
+            # Время последней отправки не обновлялось, после перезапуска они уйдут снова
+            logger.warning("Send queue stopped with %d undelivered messages", len(self._heap))
+
+    def put(self, chat_id, text=None, **kwargs):
+        """
+        Enqueues a message; it will be sent as soon as the rate limits allow.
+        Without ``text`` the message is rendered when its turn comes.
+        """
+        now = time.monotonic()
+        ready = max(now, self._chat_ready.get(chat_id, 0.0))
+        self._chat_ready[chat_id] = ready + self.per_chat_interval
+        if len(self._chat_ready) > 4 * len(self._heap) + 10000:
+            self._chat_ready = {c: t for c, t in self._chat_ready.items() if t > now}
+        heapq.heappush(self._heap, (ready, next(self._seq), chat_id, text, kwargs))
+        self._wakeup.set()
+
+    async def _next_item(self):
+        while True:
+            now = time.monotonic()
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            wait = max(self._heap[0][0], self._paused_until) - now
+            if wait <= 0:
+                return heapq.heappop(self._heap)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _worker(self):
+        while True:
+            item = await self._next_item()
+            try:
+                await self._send(item)
+            except Exception:
+                # Ни одна ошибка (в том числе из колбэков) не должна останавливать воркер
+                logger.exception("Unexpected error while sending a reminder to %s", item[2])
+
+    async def _send(self, item):
+        ready, _seq, chat_id, text, kwargs = item
+        if text is None:
+            # Текст строится в момент отправки, а не постановки в очередь
+            text = await self.render(chat_id)
+            if text is None:
+                return
+        await self._bucket.acquire()
+        try:
+            await self.bot.send_message(chat_id, text, **kwargs)
+        except RetryAfter as e:
+            self.retried += 1
+            self._paused_until = time.monotonic() + e.retry_after
+            logger.warning("Flood control hit, pausing broadcasts for %s s", e.retry_after)
+            heapq.heappush(self._heap, item)
+            self._wakeup.set()
+        except Forbidden:
+            self.failed += 1
+            try:
+                await self._notify(self.on_forbidden, chat_id)
+            finally:
+                await self._notify(self.on_failed, chat_id)
+        except TelegramError as e:
+            self.failed += 1
+            logger.warning("Failed to send reminder to %s: %s", chat_id, e)
+            await self._notify(self.on_failed, chat_id)
+        except Exception:
+            self.failed += 1
+            await self._notify(self.on_failed, chat_id)
+            raise
+        else:
+            self.sent += 1
+            await self._notify(self.on_sent, chat_id)
+
+    @staticmethod
+    async def _notify(callback, chat_id):
+        if callback is not None:
+            await callback(chat_id)
+
+
+# ---------- ПЛАНИРОВЩИК ----------
+class ReminderScheduler:
+    """
+    Keeps users in a min-heap keyed by their next reminder time.
+
+    Rescheduling a user pushes a new entry; stale entries are skipped lazily
+    when popped, so updates are O(log n) and a tick is O(k log n) for k due users.
+
+    A popped user is held in ``_sending`` until the send queue reports the
+    result through ``sent`` or ``failed``; only then is the next day scheduled.
+    A tick only tops the send queue up to ``max_backlog`` messages, the rest
+    stay on the heap; the text is rendered by ``render_due`` when sending.
+    """
+
+    def __init__(self, store, send_queue, render, max_per_tick=5000, max_backlog=1000):
+        self.store = store
+        self.send_queue = send_queue
+        self.render = render
+        self.max_per_tick = max_per_tick
+        self.max_backlog = max_backlog
+        self._heap = []
+        self._due = {}
+        self._sending = {}
+
+    def __len__(self):
+        return len(self._due)
+
+    async def load(self):
+        """
+        Fills the heap from every user with reminders enabled. Today's reminders
+        that are already past but were never sent are due immediately. Users
+        scheduled while loading keep the time they were scheduled for.
+        """
+        now = time.time()
+        rows = await self.store.load_reminders()
+        loaded = {user_id: next_due(minutes, tz, now, last) for user_id, minutes, tz, last in rows}
+        # schedule() во время загрузки видел более свежие настройки, чем прочитанные строки
+        loaded.update(self._due)
+        self._due = loaded
+        self._heap = [(due, user_id) for user_id, due in self._due.items()]
+        heapq.heapify(self._heap)
+        overdue = sum(1 for due in self._due.values() if due <= now)
+        logger.info("Loaded %d reminders, %d of them overdue", len(self._heap), overdue)
+
+    def schedule(self, record, now=None):
+        """
+        (Re)schedules the reminder for ``record`` according to its settings.
+
+        Today's reminder at the new time is marked as sent if that time has
+        already passed, so a restart does not deliver it late.
+        """
+        self._sending.pop(record.user_id, None)
+        if not record.reminders_enabled:
+            self._due.pop(record.user_id, None)
+            return
+        now = time.time() if now is None else now
+        due = next_due(record.reminder_time, record.tz_offset, now)
+        skipped = due - SECONDS_PER_DAY
+        if (record.last_reminder or 0) < skipped:
+            record.last_reminder = skipped
+            self.store.mark_dirty(record)
+        self._push(record.user_id, due)
+
+    async def sent(self, user_id):
+        """
+        Send queue callback: stores the delivered reminder and schedules the next one.
+        """
+        due = self._sending.pop(user_id, None)
+        if due is None:
+            return  # настройки поменялись, пока сообщение было в очереди
+        self._push(user_id, due + SECONDS_PER_DAY)
+        records = await self.store.get_many([user_id])
+        for record in records:
+            if (record.last_reminder or 0) < due:
+                record.last_reminder = due
+                self.store.mark_dirty(record)
+
+    async def failed(self, user_id):
+        """
+        Send queue callback: schedules the next reminder after a failed one.
+        """
+        due = self._sending.pop(user_id, None)
+        if due is not None:
+            self._push(user_id, due + SECONDS_PER_DAY)
+
+    def _push(self, user_id, due):
+        if self._due.get(user_id) == due:
+            return
+        self._due[user_id] = due
+        heapq.heappush(self._heap, (due, user_id))
+
+    async def render_due(self, user_id):
+        """
+        Send queue callback: renders the reminder of ``user_id`` from its current
+        record, or returns None when reminders were switched off meanwhile.
+        """
+        try:
+            records = await self.store.get_many([user_id])
+        except Exception:
+            # Не теряем пользователя: он снова попадёт в следующий тик
+            logger.exception("Failed to load the reminder of %s", user_id)
+            due = self._sending.pop(user_id, None)
+            if due is not None and user_id not in self._due:
+                self._push(user_id, due)
+            return None
+        if not records or not records[0].reminders_enabled:
+            self._sending.pop(user_id, None)
+            return None
+        return self.render(records[0])
+
+    def _pop_due(self, now, limit):
+        due_users = []
+        while self._heap and self._heap[0][0] <= now and len(due_users) < limit:
+            due, user_id = heapq.heappop(self._heap)
+            if self._due.get(user_id) != due:
+                continue  # устаревшая запись после переноса или отключения
+            del self._due[user_id]
+            due_users.append((user_id, due))
+        return due_users
+
+    async def tick(self, context=None):
+        """
+        Job queue callback: enqueues reminders for the users that are due, as
+        many as fit into the send queue's backlog limit.
+        """
+        now = time.time()
+        # Очередь отправки не растёт быстрее, чем разгружается: остальные ждут в куче
+        room = min(self.max_per_tick, self.max_backlog - self.send_queue.backlog)
+        due_users = self._pop_due(now, room)
+        for user_id, due in due_users:
+            self._sending[user_id] = due
+            self.send_queue.put(user_id)
+        if due_users or self.send_queue.backlog:
+            logger.info(
+                "Reminder tick: %d due, backlog %d, sending %d, scheduled %d",
+                len(due_users), self.send_queue.backlog, len(self._sending), len(self._due),
+            )
@@ -0,0 +1,87 @@
+"""
+Cohort-wide craving report over every user in the database.
+
+    python report.py
+    python report.py --db alcofree.db --tz-offset 180 --json
+
+Reads the raw craving series of all users (from the base database and any
+shard files next to it) and prints the same aggregates as the stats screen:
+7- and 30-day windows with trend, average and peak intensity, the hour-of-day
+heatmap and how often each coping method preceded a lower next rating.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import cravings
+from sharding import database_files
+from storage import DEFAULT_TZ_OFFSET, UserStore
+
+
+async def load_blobs(paths):
+    """
+    Returns the craving series buffers stored in every database in ``paths``.
+    """
+    blobs = []
+    for path in paths:
+        store = UserStore(path)
+        await store.open()
+        try:
+            blobs += await store.load_craving_blobs()
+        finally:
+            await store.close()
+    return blobs
+
+
+def build_report(blobs, now=None, tz_offset=DEFAULT_TZ_OFFSET):
+    """
+    Runs ``cravings.cohort_report`` and replaces method codes with their labels.
+    """
+    import content
+
+    # Импорт NumPy не входит во время расчёта
+    cravings.load_numpy()
+    started = time.perf_counter()
+    report = cravings.cohort_report(blobs, now, tz_offset)
+    report["method_effect"] = {
+        content.METHOD_LABELS.get(code, str(code)): {"improved": wins, "used": total}
+        for code, (wins, total) in report["method_effect"].items()
+    }
+    if report["best_method"] is not None:
+        report["best_method"] = content.METHOD_LABELS.get(report["best_method"], str(report["best_method"]))
+    report["users"] = sum(1 for blob in blobs if blob)
+    report["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", default=os.environ.get("DB_PATH", "alcofree.db"),
+                        help="base database path (shard files next to it are included)")
+    parser.add_argument("--tz-offset", type=int, default=DEFAULT_TZ_OFFSET,
+                        help="minutes from UTC used for the hour-of-day heatmap")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    paths = database_files(args.db)
+    if not paths:
+        print(f"No database found at {args.db}", file=sys.stderr)
+        return 1
+
+    report = build_report(asyncio.run(load_blobs(paths)), tz_offset=args.tz_offset)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False))
+    else:
+        for key, value in report.items():
+            print(f"{key:>14}: {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""
+Response strategies for callback-query handlers.
+
+Every button press needs two things from the bot: an answer that stops the
+button's loading indicator and the content update itself. A route handler
+only returns ``(text, reply_markup)``; ``run_callback`` delivers it with the
+strategy configured for that handler:
+
+* ``sequential`` - answer, then send a new message (two round trips in a row);
+* ``concurrent`` - answer and send a new message at the same time;
+* ``edit`` - answer and edit the pressed message in place at the same time,
+  sending a new message only when the old one cannot be edited.
+
+When the update came through the webhook and the server still holds that
+request open, the answer is returned in the webhook response instead of a
+separate Bot API call.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from telegram.error import BadRequest
+
+from metrics import METRICS, Counter
+
+logger = logging.getLogger(__name__)
+
+STRATEGIES = ("sequential", "concurrent", "edit")
+
+ANSWERS = METRICS.register(Counter(
+    "bot_callback_answers_total", "Callback queries answered, by channel (api, webhook).", labels=("via",)))
+DEBOUNCED = METRICS.register(Counter(
+    "bot_callback_debounced_total", "Repeated button presses answered without a content update."))
+
+
+def parse_strategies(value):
+    """
+    ``"craving_method_selected=concurrent"`` -> {"craving_method_selected": "concurrent"}.
+    """
+    strategies = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        handler, _, strategy = item.partition("=")
+        strategy = strategy.strip()
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown response strategy {strategy!r} for {handler.strip()}")
+        strategies[handler.strip()] = strategy
+    return strategies
+
+
+# ---------- ПОДАВЛЕНИЕ ПОВТОРНЫХ НАЖАТИЙ ----------
+class TapDebouncer:
+    """
+    Remembers the last button press of recently active users and reports
+    presses that repeat it within ``window`` seconds.
+    """
+
+    def __init__(self, window=1.0, max_users=10000):
+        self.window = window
+        self.max_users = max_users
+        self._last = OrderedDict()
+
+    def is_repeat(self, user_id, signature, now=None):
+        now = time.monotonic() if now is None else now
+        last = self._last.pop(user_id, None)
+        self._last[user_id] = (signature, now)
+        if len(self._last) > self.max_users:
+            self._last.popitem(last=False)
+        return last is not None and last[0] == signature and now - last[1] < self.window
+
+
+# ---------- ОТВЕТ НА НАЖАТИЕ ----------
+async def answer_callback(update, context):
+    """
+    Answers the callback query, through the pending webhook response when possible.
+    """
+    query = update.callback_query
+    web_server = context.bot_data.get("web_server")
+    payload = {"method": "answerCallbackQuery", "callback_query_id": query.id}
+    if web_server is not None and web_server.reply_to_webhook(update.update_id, payload):
+        ANSWERS.inc("webhook")
+        return
+    await query.answer()
+    ANSWERS.inc("api")
+
+
+async def _send_new(update, context, text, reply_markup):
+    query = update.callback_query
+    chat_id = query.message.chat_id if query.message is not None else query.from_user.id
+    await context.bot.send_message(chat_id, text, reply_markup=reply_markup)
+
+
+async def _edit(update, context, text, reply_markup):
+    query = update.callback_query
+    if query.message is None:
+        await _send_new(update, context, text, reply_markup)
+        return
+    try:
+        await query.edit_message_text(text, reply_markup=reply_markup)
+    except BadRequest as exc:
+        # Повторное нажатие той же кнопки: содержимое уже такое
+        if "not modified" in exc.message.lower():
+            return
+        # Сообщение слишком старое или удалено — отвечаем новым
+        logger.debug("Cannot edit message %s: %s", query.message.message_id, exc.message)
+        await _send_new(update, context, text, reply_markup)
+
+
+async def run_callback(update, context, handler, arg, strategy="edit"):
+    """
+    Runs a route handler that returns ``(text, reply_markup)`` or None and
+    delivers the result with ``strategy``.
+    """
+    if strategy == "sequential":
+        await answer_callback(update, context)
+        response = await handler(update, context, arg)
+        if response is not None:
+            await _send_new(update, context, *response)
+        return
+
+    # Ответ на нажатие уходит сразу и идёт параллельно с работой обработчика
+    answering = asyncio.ensure_future(answer_callback(update, context))
+    try:
+        response = await handler(update, context, arg)
+        if response is not None:
+            deliver = _edit if strategy == "edit" else _send_new
+            await deliver(update, context, *response)
+    finally:
+        await answering
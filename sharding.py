@@ -0,0 +1,377 @@
+"""
+Multi-process sharded deployment.
+
+A front process receives updates (polling or webhook) and hash-routes them
+by user id to N worker processes. Each worker runs the regular handlers on
+an Application without an updater, against its own shard of user state
+(a separate SQLite file). Bounded inter-process queues provide
+back-pressure; workers report per-shard stats and metric snapshots back to
+the front, whose ``/metrics`` exposes them with a ``shard`` label.
+
+Before any worker starts, ``rebalance_shards`` moves users from the base
+database and from shard files of a previous run into the files for the
+current number of shards, so enabling sharding or changing N keeps all
+existing state. Running with ``SHARDS=1`` moves everyone back.
+"""
+import asyncio
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+WORKER_QUEUE_SIZE = int(os.environ.get('SHARD_QUEUE_SIZE', 1000))
+WORKER_MAX_INFLIGHT = int(os.environ.get('SHARD_MAX_INFLIGHT', 256))
+WORKER_START_TIMEOUT = float(os.environ.get('SHARD_START_TIMEOUT', 30))
+WORKER_STOP_TIMEOUT = float(os.environ.get('SHARD_STOP_TIMEOUT', 15))
+STATS_INTERVAL = float(os.environ.get('SHARD_STATS_INTERVAL', 5))
+
+
+def shard_for(update, shards):
+    """
+    Returns the shard index for ``update``: by user id, else chat id, else 0.
+    """
+    user = update.effective_user
+    if user is not None:
+        return user.id % shards
+    chat = update.effective_chat
+    if chat is not None:
+        return chat.id % shards
+    return 0
+
+
+def shard_db_path(db_path, shard):
+    """
+    ``alcofree.db`` -> ``alcofree.shard0.db``.
+    """
+    root, ext = os.path.splitext(db_path)
+    return f"{root}.shard{shard}{ext or '.db'}"
+
+
+def database_files(db_path):
+    """
+    Returns the absolute paths of ``db_path`` and of every shard file next
+    to it, whatever number of shards created them, that exist on disk.
+    """
+    root, ext = os.path.splitext(db_path)
+    pattern = f"{glob.escape(root)}.shard[0-9]*{ext or '.db'}"
+    return sorted({os.path.abspath(path) for path in glob.glob(pattern) + [db_path] if os.path.exists(path)})
+
+
+def _move_rows(source, connect, targets, table, columns, batch_size=1000):
+    """
+    Copies rows of ``table`` that belong to another file into it, then
+    deletes them from ``source``. Returns the number of moved rows.
+    """
+    names = ", ".join(columns)
+    placeholders = ", ".join("?" for _ in columns)
+    moved = []
+    cursor = connect(source).execute(f"SELECT {names} FROM {table}")
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        by_target = {}
+        for row in rows:
+            target = targets[row[0] % len(targets)]
+            if target != source:
+                by_target.setdefault(target, []).append(row)
+        for target, chunk in by_target.items():
+            with connect(target) as conn:
+                conn.executemany(f"INSERT OR REPLACE INTO {table} ({names}) VALUES ({placeholders})", chunk)
+            moved += [(row[0],) for row in chunk]
+    # Удаляем только после записи в целевые файлы: при сбое строка останется в двух местах, но не пропадёт
+    if moved:
+        with connect(source) as conn:
+            conn.executemany(f"DELETE FROM {table} WHERE user_id = ?", moved)
+    return len(moved)
+
+
+def _stored_shards(db_path):
+    """
+    Returns the number of shards recorded in ``db_path`` by the last rebalance, or None.
+    """
+    if not os.path.exists(db_path):
+        return None
+    conn = sqlite3.connect(db_path)
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'shards'").fetchone()
+    except sqlite3.OperationalError:
+        row = None  # база старше таблицы meta
+    finally:
+        conn.close()
+    return int(row[0]) if row else None
+
+
+def rebalance_shards(db_path, shards):
+    """
+    Moves user rows between ``db_path`` and its shard files so that every
+    user lives in the file of ``shards`` (``db_path`` itself when ``shards``
+    is 1). Returns the number of moved rows.
+
+    The shard count is recorded in ``db_path`` afterwards; while it does not
+    change, later starts skip the scan.
+    """
+    from storage import COLUMNS, open_database
+
+    base = os.path.abspath(db_path)
+    if shards == 1:
+        targets = [base]
+    else:
+        targets = [os.path.abspath(shard_db_path(db_path, shard)) for shard in range(shards)]
+    sources = database_files(db_path)
+    # Обычный запуск без шардов или с прежним их числом не должен читать всю базу
+    if sources == targets or _stored_shards(db_path) == shards:
+        return 0
+
+    connections = {}
+
+    def connect(path):
+        if path not in connections:
+            connections[path] = open_database(path)
+        return connections[path]
+
+    moved = 0
+    try:
+        for source in sources:
+            moved += _move_rows(source, connect, targets, "users", COLUMNS)
+            moved += _move_rows(source, connect, targets, "cravings", ("user_id", "data"))
+        with connect(base) as conn:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('shards', ?)", (str(shards),))
+    finally:
+        for conn in connections.values():
+            conn.close()
+    if moved:
+        logger.info("Moved %s user rows into the files for %s shard(s)", moved, shards)
+    return moved
+
+
+# ---------- ПРОЦЕСС-ОБРАБОТЧИК ----------
+def worker_main(shard, shards, inbox, outbox):
+    """
+    Entry point of a worker process.
+    """
+    # Конфигурация bot.py читается из окружения при импорте, поэтому задаём её до импорта
+    os.environ["DB_PATH"] = shard_db_path(os.environ.get("DB_PATH", "alcofree.db"), shard)
+    os.environ["WEB_SERVER"] = "0"
+    os.environ["BROADCAST_RATE"] = str(float(os.environ.get("BROADCAST_RATE", 15)) / shards)
+    os.environ["SHARDS"] = "1"
+
+    from logging_setup import setup_logging
+    setup_logging()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # останавливает фронт, а не Ctrl+C
+
+    asyncio.run(_run_worker(shard, inbox, outbox))
+
+
+async def _run_worker(shard, inbox, outbox):
+    import bot
+    from telegram import Update
+    from metrics import METRICS
+
+    application = bot.build_application(updater=False)
+    processor = application.update_processor
+    loop = asyncio.get_running_loop()
+    received = 0
+
+    async def report_stats():
+        while True:
+            outbox.put({
+                "shard": shard,
+                "received": received,
+                "pending": application.update_queue.qsize() + processor.pending,
+                # Свой /metrics у обработчика не поднимается — метрики отдаёт фронт
+                "metrics": METRICS.snapshot(),
+            })
+            await asyncio.sleep(STATS_INTERVAL)
+
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+    stats_task = asyncio.create_task(report_stats())
+    outbox.put({"shard": shard, "ready": True, "pid": os.getpid()})
+    logger.info("Shard %s started (pid %s)", shard, os.getpid())
+    try:
+        while True:
+            payload = await loop.run_in_executor(None, inbox.get)
+            if payload is None:
+                break
+            received += 1
+            await application.update_queue.put(Update.de_json(json.loads(payload), application.bot))
+            # Обратное давление: не забираем новые обновления, пока не разгрузимся
+            while application.update_queue.qsize() + processor.pending >= WORKER_MAX_INFLIGHT:
+                await asyncio.sleep(0.005)
+    finally:
+        stats_task.cancel()
+        await application.stop()
+        await application.post_shutdown(application)
+        await application.shutdown()
+        outbox.put({
+            "shard": shard, "received": received, "pending": 0, "metrics": METRICS.snapshot(), "stopped": True,
+        })
+        logger.info("Shard %s stopped after %s updates", shard, received)
+
+
+# ---------- ФРОНТ ----------
+class ShardRouter:
+    """
+    Front-side state: worker processes, their inboxes and the stats they report.
+    """
+
+    def __init__(self, shards):
+        self.shards = shards
+        self.context = multiprocessing.get_context("spawn")
+        self.inboxes = [self.context.Queue(maxsize=WORKER_QUEUE_SIZE) for _ in range(shards)]
+        self.outbox = self.context.Queue()
+        self.processes = []
+        self.stats = {shard: {} for shard in range(shards)}
+        self._collector = None
+
+        from metrics import METRICS, Counter, Gauge
+        self.routed = METRICS.register(Counter(
+            "bot_shard_routed_total", "Updates routed to each shard.", labels=("shard",)))
+        self.processed = METRICS.register(Gauge(
+            "bot_shard_received", "Updates received by each shard worker so far.", labels=("shard",)))
+        self.pending = METRICS.register(Gauge(
+            "bot_shard_pending", "Updates in flight inside each shard worker.", labels=("shard",)))
+
+    def start(self):
+        """
+        Starts every worker and waits until all of them report ready.
+        """
+        for shard in range(self.shards):
+            process = self.context.Process(
+                target=worker_main,
+                args=(shard, self.shards, self.inboxes[shard], self.outbox),
+                name=f"shard-{shard}",
+                daemon=True,
+            )
+            process.start()
+            self.processes.append(process)
+
+        waiting = set(range(self.shards))
+        deadline = time.monotonic() + WORKER_START_TIMEOUT
+        while waiting:
+            try:
+                message = self.outbox.get(timeout=max(0.1, deadline - time.monotonic()))
+            except queue.Empty:
+                self.stop()
+                raise RuntimeError(f"Shards {sorted(waiting)} did not start in time")
+            if message.get("ready"):
+                waiting.discard(message["shard"])
+        logger.info("All %s shards are ready", self.shards)
+
+    def stop(self):
+        """
+        Asks every worker to drain and exit; terminates those that do not.
+        """
+        for inbox, process in zip(self.inboxes, self.processes):
+            if process.is_alive():
+                try:
+                    inbox.put(None, timeout=WORKER_STOP_TIMEOUT)
+                except queue.Full:
+                    pass
+        for process in self.processes:
+            process.join(WORKER_STOP_TIMEOUT)
+            if process.is_alive():
+                logger.warning("Shard process %s did not stop in time, terminating", process.name)
+                process.terminate()
+                process.join()
+        self.processes = []
+
+    async def route(self, update, context):
+        """
+        TypeHandler callback: forwards the raw update to its shard.
+        """
+        shard = shard_for(update, self.shards)
+        payload = json.dumps(update.to_dict(), ensure_ascii=False)
+        inbox = self.inboxes[shard]
+        try:
+            inbox.put_nowait(payload)
+        except queue.Full:
+            # Очередь шарда заполнена — ждём в отдельном потоке, не блокируя event loop
+            await asyncio.get_running_loop().run_in_executor(None, inbox.put, payload)
+        self.routed.inc(shard)
+
+    async def collect_stats(self):
+        from metrics import METRICS
+
+        loop = asyncio.get_running_loop()
+        while True:
+            # get с таймаутом, чтобы поток пула не висел вечно после остановки
+            try:
+                message = await loop.run_in_executor(None, self.outbox.get, True, 1.0)
+            except queue.Empty:
+                continue
+            shard = message["shard"]
+            self.stats[shard] = message
+            if "received" in message:
+                self.processed.set(message["received"], shard)
+                self.pending.set(message["pending"], shard)
+            if "metrics" in message:
+                METRICS.set_remote(shard, message["metrics"])
+
+    def start_collector(self):
+        self._collector = asyncio.create_task(self.collect_stats())
+
+    def stop_collector(self):
+        if self._collector is not None:
+            self._collector.cancel()
+            self._collector = None
+
+
+def run_sharded(shards):
+    """
+    Runs the front process with ``shards`` worker processes.
+    """
+    import bot
+    from telegram import Update
+    from telegram.ext import Application, TypeHandler
+    from metrics import METRICS
+
+    router = ShardRouter(shards)
+
+    async def front_post_init(application):
+        router.start_collector()
+        METRICS.attach(application, polling=bot.BOT_MODE != "webhook")
+        web_server = bot.create_web_server(application) if bot.WEB_SERVER_ENABLED else None
+        if web_server is not None:
+            await web_server.start()
+            application.bot_data["web_server"] = web_server
+
+    async def front_post_shutdown(application):
+        web_server = application.bot_data.pop("web_server", None)
+        if web_server is not None:
+            await web_server.stop()
+        router.stop_collector()
+
+    application = (
+        Application.builder()
+        .token(bot.BOT_TOKEN)
+        .base_url(bot.BOT_API_URL)
+        # Фронт только получает обновления и управляет вебхуком — большой пул ему не нужен
+        .request(bot.build_request(pool_size=8))
+        .get_updates_request(bot.build_get_updates_request())
+        .post_init(front_post_init)
+        .post_shutdown(front_post_shutdown)
+        .build()
+    )
+    application.add_handler(TypeHandler(Update, router.route))
+
+    router.start()
+    try:
+        logger.info("🤖 Bot started in sharded mode with %s workers", shards)
+        if bot.BOT_MODE == "webhook":
+            asyncio.run(bot.run_webhook(application))
+        else:
+            application.run_polling(allowed_updates=bot.ALLOWED_UPDATES)
+    finally:
+        router.stop()
+        for shard, stats in sorted(router.stats.items()):
+            logger.info("Shard %s: routed %s, received %s", shard, router.routed.value(shard), stats.get("received"))
@@ -0,0 +1,385 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, astuple, fields
+from typing import Optional
+
+from cravings import CravingSeries
+
+logger = logging.getLogger(__name__)
+
+SECONDS_PER_DAY = 86400
+
+# Значения по умолчанию для персональных настроек
+DEFAULT_DAILY_SPEND = 500      # руб. в день, которые уходили на алкоголь
+DEFAULT_DAILY_HOURS = 2.0      # часов в день, которые уходили на алкоголь
+DEFAULT_REMINDER_TIME = 9 * 60  # минуты от полуночи по местному времени
+DEFAULT_TZ_OFFSET = 3 * 60     # минуты от UTC (Москва)
+
+
+# ---------- МОДЕЛЬ ----------
+@dataclass
+class UserRecord:
+    """
+    Persistent per-user state: journey timestamps plus personal settings.
+    Field order matches the column order of the ``users`` table.
+    """
+    user_id: int
+    journey_start: Optional[float] = None
+    last_relapse: Optional[float] = None
+    relapse_count: int = 0
+    daily_spend: int = DEFAULT_DAILY_SPEND
+    daily_hours: float = DEFAULT_DAILY_HOURS
+    reminders_enabled: int = 1
+    reminder_time: int = DEFAULT_REMINDER_TIME
+    tz_offset: int = DEFAULT_TZ_OFFSET
+    # UTC-время последнего напоминания, которое отправлено или сознательно пропущено
+    last_reminder: Optional[float] = None
+
+    @property
+    def journey_active(self):
+        return self.journey_start is not None
+
+    def sober_seconds(self, now=None):
+        """
+        Returns seconds since the journey started (0 if it is not running).
+        """
+        if self.journey_start is None:
+            return 0.0
+        now = time.time() if now is None else now
+        return max(0.0, now - self.journey_start)
+
+    def stats(self, now=None):
+        """
+        Computes sobriety statistics in O(1) from the stored timestamps.
+        """
+        sober_days = self.sober_seconds(now) / SECONDS_PER_DAY
+        days = int(sober_days)
+        return {
+            "days": days,
+            "money_saved": int(sober_days * self.daily_spend),
+            "hours_saved": int(sober_days * self.daily_hours),
+            "health_percent": min(days * 2, 100),
+            "relapse_count": self.relapse_count,
+        }
+
+
+COLUMNS = [f.name for f in fields(UserRecord)]
+COLUMN_TYPES = {
+    "user_id": "INTEGER PRIMARY KEY",
+    "journey_start": "REAL",
+    "last_relapse": "REAL",
+    "relapse_count": "INTEGER NOT NULL DEFAULT 0",
+    "daily_spend": f"INTEGER NOT NULL DEFAULT {DEFAULT_DAILY_SPEND}",
+    "daily_hours": f"REAL NOT NULL DEFAULT {DEFAULT_DAILY_HOURS}",
+    "reminders_enabled": "INTEGER NOT NULL DEFAULT 1",
+    "reminder_time": f"INTEGER NOT NULL DEFAULT {DEFAULT_REMINDER_TIME}",
+    "tz_offset": f"INTEGER NOT NULL DEFAULT {DEFAULT_TZ_OFFSET}",
+    "last_reminder": "REAL",
+}
+
+
+def open_database(path):
+    """
+    Opens the SQLite database at ``path``, creating or migrating its schema.
+    """
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    columns = ", ".join(f"{name} {COLUMN_TYPES[name]}" for name in COLUMNS)
+    conn.execute(f"CREATE TABLE IF NOT EXISTS users ({columns})")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS cravings (user_id INTEGER PRIMARY KEY, data BLOB NOT NULL)"
+    )
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+    # Простая миграция: добавляем недостающие колонки
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(users)")}
+    for name in COLUMNS:
+        if name not in existing:
+            conn.execute(f"ALTER TABLE users ADD COLUMN {name} {COLUMN_TYPES[name]}")
+    if "last_reminder" not in existing:
+        # Прежние версии не запоминали отправку: считаем сегодняшние напоминания доставленными
+        conn.execute("UPDATE users SET last_reminder = ?", (time.time(),))
+    conn.commit()
+    return conn
+
+
+# ---------- ХРАНИЛИЩЕ ----------
+class UserStore:
+    """
+    Async SQLite-backed user store.
+
+    Reads go through a bounded LRU cache. Writes only mark records dirty; a
+    background task flushes all dirty records in a single transaction, so a
+    burst of button taps costs one fsync instead of one per tap. All SQLite
+    work runs on a dedicated thread and never blocks the event loop.
+    """
+
+    def __init__(self, path, cache_size=10000, flush_interval=1.0, flush_batch=500):
+        self.path = path
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self._cache = OrderedDict()
+        self._dirty = {}
+        self._loading = {}
+        # Ряды событий тяги хранятся отдельно: они нужны только экрану статистики
+        self._cravings = OrderedDict()
+        self._cravings_dirty = {}
+        self._conn = None
+        # Один поток = одно соединение SQLite, все запросы сериализуются
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="user-store")
+        self._flush_wakeup = None
+        self._flush_task = None
+
+    # --- жизненный цикл ---
+    async def open(self):
+        """
+        Opens the database, creates/migrates the schema and starts the flusher.
+        """
+        await self._run(self._open_sync)
+        self._flush_wakeup = asyncio.Event()
+        self._flush_task = asyncio.create_task(self._flush_loop())
+        logger.info("User store opened at %s", self.path)
+
+    async def close(self):
+        """
+        Stops the flusher, writes out every dirty record and closes the database.
+        """
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+        await self._run(self._close_sync)
+        self._executor.shutdown(wait=True)
+        logger.info("User store closed")
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _open_sync(self):
+        self._conn = open_database(self.path)
+
+    def _close_sync(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    # --- чтение ---
+    async def get(self, user_id):
+        """
+        Returns the record for ``user_id``, loading or creating it if needed.
+        """
+        record = self._cache.get(user_id)
+        if record is not None:
+            self._cache.move_to_end(user_id)
+            return record
+        record = self._dirty.get(user_id)
+        if record is not None:
+            self._remember(record)
+            return record
+
+        # Несколько одновременных запросов одного пользователя — одно чтение с диска
+        pending = self._loading.get(user_id)
+        if pending is None:
+            pending = asyncio.ensure_future(self._run(self._load_sync, user_id))
+            self._loading[user_id] = pending
+            try:
+                record = await pending
+            finally:
+                del self._loading[user_id]
+            self._remember(record)
+            return record
+        return await asyncio.shield(pending)
+
+    def _load_sync(self, user_id):
+        row = self._conn.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM users WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        if row is None:
+            return UserRecord(user_id=user_id)
+        return UserRecord(*row)
+
+    async def get_many(self, user_ids):
+        """
+        Returns records for ``user_ids`` using one query for the uncached ones.
+        Records read this way are not added to the LRU, so bulk jobs do not
+        evict the users who are actively chatting.
+        """
+        found = {}
+        missing = []
+        for user_id in user_ids:
+            record = self._cache.get(user_id) or self._dirty.get(user_id)
+            if record is not None:
+                found[user_id] = record
+            else:
+                missing.append(user_id)
+        if missing:
+            for record in await self._run(self._load_many_sync, missing):
+                found[record.user_id] = record
+        return [found[user_id] for user_id in user_ids if user_id in found]
+
+    def _load_many_sync(self, user_ids):
+        placeholders = ", ".join("?" for _ in user_ids)
+        rows = self._conn.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM users WHERE user_id IN ({placeholders})", user_ids
+        ).fetchall()
+        return [UserRecord(*row) for row in rows]
+
+    async def load_reminders(self):
+        """
+        Returns ``(user_id, reminder_time, tz_offset, last_reminder)`` for every
+        user with reminders enabled.
+        """
+        await self.flush()
+        return await self._run(self._load_reminders_sync)
+
+    def _load_reminders_sync(self):
+        return self._conn.execute(
+            "SELECT user_id, reminder_time, tz_offset, last_reminder FROM users WHERE reminders_enabled = 1"
+        ).fetchall()
+
+    def _remember(self, record):
+        self._cache[record.user_id] = record
+        self._cache.move_to_end(record.user_id)
+        # Грязные записи можно вытеснять: они остаются в self._dirty до сброса
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def get_cravings(self, user_id):
+        """
+        Returns the craving series of ``user_id`` (empty if there is none yet).
+        """
+        # Пустой ряд ложен (len == 0), поэтому сравниваем с None явно
+        series = self._cravings.get(user_id)
+        if series is None:
+            series = self._cravings_dirty.get(user_id)
+        if series is None:
+            loaded = await self._run(self._load_cravings_sync, user_id)
+            series = self._cravings.get(user_id)
+            if series is None:
+                series = loaded
+        self._cravings[user_id] = series
+        self._cravings.move_to_end(user_id)
+        while len(self._cravings) > self.cache_size:
+            self._cravings.popitem(last=False)
+        return series
+
+    def _load_cravings_sync(self, user_id):
+        row = self._conn.execute("SELECT data FROM cravings WHERE user_id = ?", (user_id,)).fetchone()
+        return CravingSeries(row[0] if row else b"")
+
+    async def load_craving_blobs(self):
+        """
+        Returns every stored craving series as raw bytes, for cohort reports.
+        """
+        await self.flush()
+        rows = await self._run(lambda: self._conn.execute("SELECT data FROM cravings").fetchall())
+        return [row[0] for row in rows]
+
+    # --- запись ---
+    def mark_dirty(self, record):
+        """
+        Schedules ``record`` for the next batched write.
+        """
+        self._dirty[record.user_id] = record
+        if len(self._dirty) >= self.flush_batch and self._flush_wakeup is not None:
+            self._flush_wakeup.set()
+
+    async def start_journey(self, user_id, now=None):
+        """
+        Starts (or restarts) the sobriety journey for a user.
+        """
+        record = await self.get(user_id)
+        record.journey_start = time.time() if now is None else now
+        self.mark_dirty(record)
+        return record
+
+    async def record_relapse(self, user_id, now=None):
+        """
+        Records a relapse and stops the current journey.
+        """
+        record = await self.get(user_id)
+        record.last_relapse = time.time() if now is None else now
+        record.relapse_count += 1
+        record.journey_start = None
+        self.mark_dirty(record)
+        return record
+
+    async def record_craving(self, user_id, level, now=None):
+        """
+        Appends a craving rating to the user's series.
+        """
+        series = await self.get_cravings(user_id)
+        series.append(level, now)
+        self._mark_cravings_dirty(user_id, series)
+        return series
+
+    async def record_craving_method(self, user_id, method_code, now=None):
+        """
+        Attaches the chosen coping method to the user's latest craving rating.
+        """
+        series = await self.get_cravings(user_id)
+        if series.set_method(method_code, now):
+            self._mark_cravings_dirty(user_id, series)
+        return series
+
+    def _mark_cravings_dirty(self, user_id, series):
+        self._cravings_dirty[user_id] = series
+        if len(self._cravings_dirty) >= self.flush_batch and self._flush_wakeup is not None:
+            self._flush_wakeup.set()
+
+    async def flush(self):
+        """
+        Writes every dirty record and craving series in a single transaction.
+        """
+        if not self._dirty and not self._cravings_dirty:
+            return 0
+        batch, self._dirty = self._dirty, {}
+        cravings, self._cravings_dirty = self._cravings_dirty, {}
+        rows = [astuple(record) for record in batch.values()]
+        craving_rows = [(user_id, bytes(series.data)) for user_id, series in cravings.items()]
+        try:
+            await self._run(self._write_sync, rows, craving_rows)
+        except Exception:
+            # Не теряем изменения: вернём их в очередь, если их не перезаписали
+            for user_id, record in batch.items():
+                self._dirty.setdefault(user_id, record)
+            for user_id, series in cravings.items():
+                self._cravings_dirty.setdefault(user_id, series)
+            raise
+        return len(rows) + len(craving_rows)
+
+    def _write_sync(self, rows, craving_rows):
+        placeholders = ", ".join("?" for _ in COLUMNS)
+        with self._conn:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO users ({', '.join(COLUMNS)}) VALUES ({placeholders})",
+                rows,
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO cravings (user_id, data) VALUES (?, ?)",
+                craving_rows,
+            )
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_wakeup.clear()
+            try:
+                written = await self.flush()
+                if written:
+                    logger.debug("Flushed %d user records and craving series", written)
+            except Exception as e:
+                logger.error("Failed to flush user store: %s", e)
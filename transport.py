@@ -0,0 +1,125 @@
+"""
+Tuned HTTP transport for Bot API calls.
+
+``BotAPIRequest`` is an ``InstrumentedRequest`` with an explicitly sized,
+keep-alive connection pool, optional HTTP/2 and per-method read timeouts.
+Its client goes through ``TracingTransport``, which uses httpcore trace
+events to split every call into time spent waiting for a pooled
+connection, time opening a new connection and time on the wire.
+"""
+import logging
+import time
+
+import httpx
+
+from metrics import METRICS, InstrumentedRequest
+
+try:
+    import h2
+except ImportError:
+    h2 = None
+
+logger = logging.getLogger(__name__)
+
+
+def parse_method_timeouts(value):
+    """
+    ``"sendMessage=10,answerCallbackQuery=3"`` -> {"sendMessage": 10.0, ...}.
+    """
+    timeouts = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        method, _, seconds = item.partition("=")
+        timeouts[method.strip()] = float(seconds)
+    return timeouts
+
+
+# ---------- ТРАССИРОВКА ----------
+class _CallTrace:
+    """
+    Timestamps of one HTTP exchange, filled in from httpcore trace events.
+    """
+
+    __slots__ = ("api_method", "metrics", "started", "acquired", "connecting", "sent")
+
+    def __init__(self, api_method, metrics):
+        self.api_method = api_method
+        self.metrics = metrics
+        self.started = time.perf_counter()
+        self.acquired = self.connecting = self.sent = None
+
+    async def __call__(self, event, info):
+        now = time.perf_counter()
+        if event == "connection.connect_tcp.started":
+            # Свободного соединения не нашлось — пул открывает новое
+            self.acquired = self.acquired or now
+            self.connecting = now
+        elif event.endswith(".send_request_headers.started"):
+            self.acquired = self.acquired or now
+            self.sent = now
+        elif event.endswith(".response_closed.complete") and self.sent is not None:
+            connect = self.sent - self.connecting if self.connecting is not None else None
+            self.metrics.observe_api_phases(self.api_method, self.acquired - self.started, connect, now - self.sent)
+
+
+class TracingTransport(httpx.AsyncBaseTransport):
+    """
+    Wraps a transport and attaches a trace callback to every request.
+    """
+
+    def __init__(self, transport, metrics=METRICS):
+        self.transport = transport
+        self.metrics = metrics
+
+    async def handle_async_request(self, request):
+        api_method = request.url.path.rpartition("/")[2]
+        request.extensions = {**request.extensions, "trace": _CallTrace(api_method, self.metrics)}
+        return await self.transport.handle_async_request(request)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+# ---------- ЗАПРОСЫ К BOT API ----------
+class BotAPIRequest(InstrumentedRequest):
+    """
+    InstrumentedRequest with a tuned connection pool and per-method timeouts.
+
+    ``method_timeouts`` maps Bot API methods to read timeouts used when the
+    caller does not pass one explicitly. HTTP/2 falls back to HTTP/1.1 with a
+    warning when the ``h2`` package is not installed.
+    """
+
+    def __init__(self, connection_pool_size=1, keepalive_expiry=5.0, http2=False,
+                 method_timeouts=None, metrics=METRICS, **kwargs):
+        if http2 and h2 is None:
+            logger.warning("HTTP/2 requested but the h2 package is not installed, using HTTP/1.1")
+            http2 = False
+        # _build_client вызывается из конструктора базового класса, поэтому настройки задаём до него
+        self.keepalive_expiry = keepalive_expiry
+        self.method_timeouts = method_timeouts or {}
+        self.metrics = metrics
+        super().__init__(
+            connection_pool_size=connection_pool_size,
+            http_version="2" if http2 else "1.1",
+            metrics=metrics,
+            **kwargs
+        )
+
+    def _build_client(self):
+        kwargs = dict(self._client_kwargs)
+        limits = kwargs["limits"]
+        kwargs["limits"] = httpx.Limits(
+            max_connections=limits.max_connections,
+            max_keepalive_connections=limits.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+        # Переданный транспорт httpx не настраивает сам: лимиты и версию HTTP задаём ему напрямую
+        inner = httpx.AsyncHTTPTransport(limits=kwargs["limits"], http1=kwargs["http1"], http2=kwargs["http2"])
+        kwargs["transport"] = TracingTransport(inner, self.metrics)
+        return httpx.AsyncClient(**kwargs)
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        read_timeout = self.method_timeouts.get(url.rpartition("/")[2])
+        if read_timeout is not None and kwargs.get("read_timeout", self.DEFAULT_NONE) is self.DEFAULT_NONE:
+            kwargs["read_timeout"] = read_timeout
+        return await super().do_request(url, method, request_data, **kwargs)
@@ -0,0 +1,124 @@
+"""
+Concurrent update processing with per-user ordering.
+"""
+import asyncio
+from collections import deque
+
+from telegram.ext import BaseUpdateProcessor
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes updates of different users concurrently while keeping the
+    updates of one user (or chat) strictly in arrival order.
+
+    Every user has a FIFO of pending updates. Users with pending work wait in
+    a round-robin ring; at most ``concurrency`` users run at a time and a user
+    goes to the back of the ring after each update, so a user sending many
+    updates cannot starve the others.
+
+    PTB's own semaphore (``max_pending``) only bounds how many updates may be
+    waiting here; the real concurrency bound is enforced by this class.
+    """
+
+    def __init__(self, concurrency=16, max_pending=10000):
+        super().__init__(max_pending)
+        if concurrency < 1:
+            raise ValueError("`concurrency` must be a positive integer!")
+        self.concurrency = concurrency
+        self._queues = {}
+        self._ready = deque()
+        self._running = 0
+        self._pending = 0
+
+    @property
+    def pending(self):
+        """
+        Number of updates accepted but not finished yet (running or waiting).
+        """
+        return self._pending
+
+    @property
+    def running(self):
+        return self._running
+
+    @staticmethod
+    def key_for(update):
+        """
+        Returns the ordering key: user id, else chat id, else a key unique to the update.
+        """
+        user = getattr(update, "effective_user", None)
+        if user is not None:
+            return user.id
+        chat = getattr(update, "effective_chat", None)
+        if chat is not None:
+            return chat.id
+        return ("update", id(update))
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_process_update(self, update, coroutine):
+        key = self.key_for(update)
+        turn = asyncio.get_running_loop().create_future()
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = deque()
+            self._ready.append(key)
+        queue.append(turn)
+        self._pending += 1
+        self._dispatch()
+
+        try:
+            await turn
+        except asyncio.CancelledError:
+            if turn.done() and not turn.cancelled():
+                # Очередь уже дошла до нас — освобождаем слот как обычно
+                self._finish(key)
+            else:
+                self._withdraw(key, turn)
+            coroutine.close()
+            raise
+
+        try:
+            await coroutine
+        finally:
+            self._finish(key)
+
+    def _dispatch(self):
+        while self._running < self.concurrency and self._ready:
+            key = self._ready.popleft()
+            queue = self._queues[key]
+            # Отменённые ожидания убираем сразу, их владельцы уже не ждут очереди
+            while queue and queue[0].cancelled():
+                queue.popleft()
+                self._pending -= 1
+            if not queue:
+                del self._queues[key]
+                continue
+            self._running += 1
+            queue[0].set_result(None)
+
+    def _finish(self, key):
+        self._running -= 1
+        self._pending -= 1
+        queue = self._queues[key]
+        queue.popleft()
+        if queue:
+            self._ready.append(key)
+        else:
+            del self._queues[key]
+        self._dispatch()
+
+    def _withdraw(self, key, turn):
+        queue = self._queues.get(key)
+        if queue is None or turn not in queue:
+            return  # уже убрано в _dispatch
+        self._pending -= 1
+        queue.remove(turn)
+        if not queue:
+            del self._queues[key]
+            self._ready.remove(key)
@@ -0,0 +1,141 @@
+import asyncio
+import hmac
+import logging
+
+try:
+    from aiohttp import web
+except ImportError:
+    web = None
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebServer:
+    """
+    Minimal aiohttp server running on the same event loop as the Application.
+
+    Always serves ``/``, ``/health`` (liveness), ``/ready`` (readiness) and
+    ``/metrics`` (Prometheus text format). When ``webhook_path`` is given it also
+    accepts Telegram updates on that path and feeds them straight into
+    ``application.update_queue``. With ``reply_timeout`` set, the request
+    carrying a callback query is held open that long so the handler can
+    return one Bot API call in the response (see ``reply_to_webhook``).
+    """
+
+    def __init__(self, application, host, port, webhook_path=None, secret_token=None, metrics=None,
+                 reply_timeout=0.0):
+        if web is None:
+            raise RuntimeError("aiohttp is not installed; the web server is unavailable.")
+        self.application = application
+        self.host = host
+        self.port = port
+        self.webhook_path = webhook_path
+        self.secret_token = secret_token
+        self.metrics = metrics
+        self.reply_timeout = reply_timeout
+        self._replies = {}
+        self._runner = None
+
+    def build_app(self):
+        """
+        Creates the aiohttp application with all routes registered.
+        """
+        app = web.Application()
+        app.router.add_get("/", self.home)
+        app.router.add_get("/health", self.health)
+        if self.metrics is not None:
+            app.router.add_get("/ready", self.ready)
+            app.router.add_get("/metrics", self.metrics_handler)
+        if self.webhook_path:
+            app.router.add_post(self.webhook_path, self.webhook)
+        return app
+
+    async def start(self):
+        """
+        Binds the server and starts accepting connections.
+        """
+        self._runner = web.AppRunner(self.build_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host=self.host, port=self.port)
+        await site.start()
+        logger.info("Web server listening on %s:%s", self.host, self.port)
+
+    async def stop(self):
+        """
+        Stops accepting connections and releases the port.
+        """
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+            logger.info("Web server stopped")
+
+    def reply_to_webhook(self, update_id, payload):
+        """
+        Sends ``payload`` (a Bot API call with a "method" key) as the response
+        to the webhook request of ``update_id``. Returns False when that
+        request is no longer waiting.
+        """
+        future = self._replies.pop(update_id, None)
+        if future is None or future.done():
+            return False
+        future.set_result(payload)
+        return True
+
+    # ---------- МАРШРУТЫ ----------
+    async def home(self, request):
+        return web.Response(text="🤖 Бот трезвости работает! Открой Telegram и напиши /start")
+
+    async def health(self, request):
+        return web.Response(text="OK")
+
+    async def ready(self, request):
+        ready, reasons = self.metrics.readiness()
+        if ready:
+            return web.Response(text="READY")
+        return web.Response(status=503, text="NOT READY\n" + "\n".join(reasons))
+
+    async def metrics_handler(self, request):
+        return web.Response(text=self.metrics.render(), content_type="text/plain", charset="utf-8")
+
+    async def webhook(self, request):
+        """
+        Accepts one Telegram update and hands it to the Application.
+        """
+        if self.secret_token is not None:
+            received = request.headers.get(SECRET_HEADER, "")
+            if not hmac.compare_digest(received, self.secret_token):
+                logger.warning("Rejected webhook request with invalid secret token")
+                return web.Response(status=403)
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        if not isinstance(data, dict):
+            return web.Response(status=400)
+
+        try:
+            update = Update.de_json(data, self.application.bot)
+        except (TypeError, KeyError, ValueError, AttributeError) as exc:
+            # Например, объект без update_id или с числом вместо вложенного объекта
+            logger.warning("Rejected malformed webhook update: %s", exc)
+            return web.Response(status=400)
+        if update is None:
+            return web.Response(status=400)
+        if not self.reply_timeout or update.callback_query is None:
+            await self.application.update_queue.put(update)
+            return web.Response()
+
+        future = asyncio.get_running_loop().create_future()
+        self._replies[update.update_id] = future
+        await self.application.update_queue.put(update)
+        try:
+            payload = await asyncio.wait_for(future, self.reply_timeout)
+        except asyncio.TimeoutError:
+            return web.Response()
+        finally:
+            self._replies.pop(update.update_id, None)
+        return web.json_response(payload)